@@ -0,0 +1,181 @@
+# Read-only JSON API over the same shared snapshot the app uses, for the kiosk
+# display and the family dashboard. Responses are cached per URL under an ETag
+# taken from the data file version, and a matching If-None-Match gets a 304.
+#
+#   python api_server.py --port 8503
+#
+# or run it inside the Streamlit server process by setting SELENE_API_PORT.
+#
+#   GET /messages?page=1&per_page=50&order=desc
+#   GET /bookings?start=2025-07-01&end=2025-07-31&status=Confirmed,Blocked
+#   GET /calendar.ics
+#   GET /metrics
+#   GET /ready         200 once the data is loaded and indexed, 503 before
+import argparse
+import bisect
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from records import normalize_date, normalize_status
+import ics
+import metrics
+import store
+
+DEFAULT_PORT = 8503
+MAX_PER_PAGE = 500
+CACHE_SIZE = 256  # cached responses, by URL
+
+_cache = OrderedDict()  # (path, query) -> (etag, body)
+_cache_lock = threading.Lock()
+_dates = (None, [])  # (snapshot version, sorted dates that have bookings)
+
+
+def _int_param(params, name, default, low, high):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    return min(max(value, low), high)
+
+
+def messages_page(snap, params):
+    page = _int_param(params, 'page', 1, 1, 10 ** 9)
+    per_page = _int_param(params, 'per_page', 50, 1, MAX_PER_PAGE)
+    total = len(snap.messages)
+    if params.get('order', 'asc') == 'desc':
+        end = max(total - (page - 1) * per_page, 0)
+        items = snap.messages[max(end - per_page, 0):end][::-1]
+    else:
+        start = (page - 1) * per_page
+        items = snap.messages[start:start + per_page]
+    return {'page': page, 'per_page': per_page, 'total': total, 'messages': items}
+
+
+def _sorted_dates(snap):
+    global _dates
+    version, dates = _dates
+    if version != snap.version:
+        dates = sorted(d for d in snap.by_date if isinstance(d, str))
+        _dates = (snap.version, dates)
+    return dates
+
+
+def bookings_range(snap, params):
+    dates = _sorted_dates(snap)
+    start = normalize_date(params['start']) if params.get('start') else None
+    end = normalize_date(params['end']) if params.get('end') else None
+    statuses = None
+    if params.get('status'):
+        statuses = {normalize_status(s) for s in params['status'].split(',')}
+    i = bisect.bisect_left(dates, start) if start else 0
+    j = bisect.bisect_right(dates, end) if end else len(dates)
+    result = [b for d in dates[i:j] for b in snap.by_date[d]
+              if statuses is None or b.get('status', 'Pending') in statuses]
+    return {'start': start, 'end': end, 'total': len(result), 'bookings': result}
+
+
+# path -> (which data file it depends on, handler)
+ROUTES = {
+    '/messages': ('messages', messages_page),
+    '/bookings': ('bookings', bookings_range),
+}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out as separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        metrics.incr('api.requests')
+        url = urlsplit(self.path)
+        if url.path == '/calendar.ics':
+            return self._send_calendar()
+        if url.path == '/metrics':
+            return self._send(200, json.dumps(metrics.snapshot()).encode('utf-8'))
+        if url.path == '/ready':
+            if store.ready.is_set():
+                return self._send(200, b'{"ready": true}')
+            return self._send(503, b'{"ready": false}')
+        route = ROUTES.get(url.path)
+        if route is None:
+            return self._send(404, b'{"error": "not found"}')
+        kind, handler = route
+        snap = store.snapshot()
+        tag = f'"{kind}-{snap.stamps.get(kind, "0")}"'
+        if tag in self.headers.get('If-None-Match', ''):
+            metrics.incr('api.not_modified')
+            return self._send(304, b'', tag)
+        key = (url.path, url.query)
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None and cached[0] == tag:
+                _cache.move_to_end(key)
+        if cached is not None and cached[0] == tag:
+            metrics.incr('api.cache_hits')
+            return self._send(200, cached[1], tag)
+        try:
+            body = json.dumps(handler(snap, dict(parse_qsl(url.query))),
+                              separators=(',', ':')).encode('utf-8')
+        except ValueError as e:
+            return self._send(400, json.dumps({'error': str(e)}).encode('utf-8'))
+        with _cache_lock:
+            _cache[key] = (tag, body)
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        self._send(200, body, tag)
+
+    def _send_calendar(self):
+        snap = store.snapshot()
+        tag, body = ics.calendar_bytes(snap)
+        if tag in self.headers.get('If-None-Match', ''):
+            return self._send(304, b'', tag)
+        self._send(200, body, tag, 'text/calendar; charset=utf-8')
+
+    def _send(self, code, body, tag=None, content_type='application/json'):
+        self.send_response(code)
+        if tag:
+            self.send_header('ETag', tag)
+            self.send_header('Cache-Control', 'no-cache')
+        if code != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if code != 304 and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=DEFAULT_PORT, host='127.0.0.1'):
+    store.start_watching()
+    return ThreadingHTTPServer((host, port), ApiHandler)
+
+
+def start_in_background(port=DEFAULT_PORT, host='127.0.0.1'):
+    # for running inside the Streamlit server process
+    server = make_server(port, host)
+    threading.Thread(target=server.serve_forever, name='selene-api', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Club Selene read-only JSON API.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args(argv)
+    server = make_server(args.port, args.host)
+    print(f"serving http://{args.host}:{args.port}/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,88 @@
 import streamlit as st
-import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import calendar
 import uuid
+import os
+import hashlib
+import json
+import store
+import metrics
+import ics
+import export
+import api_server
+import write_server
+import throttle
+import memprofile
+from month_calendar import month_calendar
+from import_bookings import guess_format, import_bytes
+from events import bus
+from schedule import (DEFAULT_DURATION, booking_interval, format_interval,
+                      next_free_dates, next_free_slots)
 
 # Load PIN from secrets
 pin_code = st.secrets["pin_key"]
 
-# Data files
-CHAT_FILE = 'chat_messages.json'
-BOOKINGS_FILE = 'bookings.json'
+# How often open tabs look for new messages / bookings from other sessions
+CHAT_REFRESH_SECONDS = 2
+# Messages are shown a page at a time, newest page first; only that page is read
+MESSAGES_PER_PAGE = 50
+
+# Set to also serve the read-only JSON API from this process (see api_server.py)
+API_PORT = os.environ.get('SELENE_API_PORT')
+# ... and the write API for other local services (see write_server.py)
+WRITE_PORT = os.environ.get('SELENE_WRITE_PORT')
+
+# Once per server process: watch the data files, count bus events, start the APIs.
+# serve.py has normally loaded and indexed the data before the server came up;
+# otherwise the first run does it here.
+@st.cache_resource
+def start_services():
+    metrics.track_events(bus)
+    memprofile.start()
+    store.warm_start()
+    if API_PORT:
+        api_server.start_in_background(int(API_PORT))
+    if WRITE_PORT:
+        write_server.start_in_background(int(WRITE_PORT))
+    return store.start_watching()
+
+start_services()
+
+# Every session reads the same shared snapshot; take it once so the whole rerun
+# sees one consistent version
+snap = store.snapshot()
+st.session_state['_bookings_seen'] = snap.bookings_version
+# Write limits are per session (see throttle.py)
+if '_session_id' not in st.session_state:
+    st.session_state['_session_id'] = str(uuid.uuid4())
+session_id = st.session_state['_session_id']
 
-# Helper functions
-def load_data(file):
-    try:
-        with open(file, 'r') as f:
-            return json.load(f)
-    except:
-        return []
+# Idempotency key for a form submit: the token of the form render the user
+# submitted from, plus what they entered. The token is part of the form's key, so
+# it travels with the rendered form: a double click or a replayed submit from that
+# render gives the same key and the store saves it only once. A write uses the
+# token up (see written), so a click still arriving from the old render matches no
+# form and is dropped, and the next submit is a new write, even with the same text.
+def form_token(form):
+    token_key = f"_{form}_token"
+    if token_key not in st.session_state:
+        st.session_state[token_key] = str(uuid.uuid4())
+    return st.session_state[token_key]
 
-def save_data(data, file):
-    with open(file, 'w') as f:
-        json.dump(data, f)
+def submit_key(form, *fields):
+    content = json.dumps([form_token(form), session_id, *fields], default=str)
+    return f"{form}:{hashlib.sha1(content.encode('utf-8')).hexdigest()}"
 
-# Load data
-messages = load_data(CHAT_FILE)
-bookings = load_data(BOOKINGS_FILE)
+# After a write: new token, and rerun so the browser gets the form that has it.
+# What to tell the user is kept for that run (see show_notices).
+def written(form, *notices):
+    st.session_state[f"_{form}_token"] = str(uuid.uuid4())
+    st.session_state[f"_{form}_notices"] = notices
+    st.rerun()
+
+def show_notices(form):
+    for kind, text in st.session_state.pop(f"_{form}_notices", ()):
+        getattr(st, kind)(text)
 
 st.title("Welcome to Club-Selene!")
 st.subheader("... a hub for messages and play-dates.  ; )")
@@ -34,28 +91,32 @@ st.subheader("... a hub for messages and play-dates.  ; )")
 # --- Chat Section ---
 # ==========================
 st.header("Leave a Message")
-with st.form("chat_form", clear_on_submit=True):
+with st.form(f"chat_form_{form_token('chat_form')}", clear_on_submit=True):
     user_name = st.text_input("Your Name")
     message = st.text_area("Message")
-    if st.form_submit_button("Send") and user_name and message:
-        msg_id = str(uuid.uuid4())
-        messages.append({
-            "id": msg_id,
-            "name": user_name,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
-        })
-        save_data(messages, CHAT_FILE)
-        st.success("Message sent!")
-
-# Display messages with delete option
-st.subheader("Messages")
-for msg in messages:
-    try:
-        dt = datetime.fromisoformat(msg['timestamp'])
-        human_time = dt.strftime('%A, %B %d, %Y at %I:%M %p')
-    except:
-        human_time = msg['timestamp']
+    sent = st.form_submit_button("Send")
+    key = submit_key("chat_form", user_name, message)
+    if sent and user_name and message:
+        allowed, wait = True, 0
+        if store.earlier(key) is None:
+            allowed, wait = throttle.allow('chat', session_id, user_name)
+        if not allowed:
+            st.error(f"Slow down a little, please try again in {wait:.0f} seconds.")
+        else:
+            msg_id = str(uuid.uuid4())
+            if store.add_message({
+                "id": msg_id,
+                "name": user_name,
+                "message": message,
+                "timestamp": datetime.now().isoformat()
+            }, key):
+                written("chat_form", ("success", "Message sent!"))
+            else:
+                st.info("That message was already sent.")
+show_notices("chat_form")
+
+def show_message(snap, msg):
+    human_time = snap.message_time(msg)
     st.write(f"**{msg['name']}**")
     st.write(f"{msg['message']}")
     st.write(f"{human_time}")
@@ -78,8 +139,7 @@ for msg in messages:
         if st.button("Confirm Delete", key=f"confirm_del_{msg['id']}"):
             if entered_pin == pin_code:
                 try:
-                    messages = [m for m in messages if m['id'] != msg['id']]
-                    save_data(messages, CHAT_FILE)
+                    store.delete_message(msg['id'])
                     st.success("Message deleted.")
                     st.session_state[toggle_key] = False
                     # Optionally clear the PIN input
@@ -89,66 +149,154 @@ for msg in messages:
             else:
                 st.error("Incorrect PIN.")
 
+# Display messages with delete option. The page of messages is rendered once (a
+# fragment, so paging doesn't rerun the whole page) and stays on screen as it is;
+# follow_messages then adds what arrives after it. A refresh never reads files,
+# it just picks up the current shared snapshot.
+@st.fragment
+def show_messages():
+    snap = store.snapshot()
+    st.subheader("Messages")
+    # pages counted back from the newest, so new messages don't move an older page
+    total = len(snap.messages)
+    pages = max(1, -(-total // MESSAGES_PER_PAGE))
+    back = min(st.session_state.get('chat_pages_back', 0), pages - 1)
+    if pages > 1:
+        older, where, newer, jump = st.columns([1, 2, 1, 2])
+        day = jump.date_input("Go to date", value=None, key="chat_jump",
+                              label_visibility='collapsed')
+        if day is not None and day != st.session_state.get('_chat_jumped'):
+            # the page holding the first message from that day on
+            back = (total - 1 - snap.message_index_at(day.isoformat())) // MESSAGES_PER_PAGE
+        st.session_state['_chat_jumped'] = day
+        if older.button("⬅️ Older", key="chat_older"):
+            back += 1
+        if newer.button("Newer ➡️", key="chat_newer"):
+            back -= 1
+        back = max(0, min(pages - 1, back))
+        where.caption(f"Page {pages - back} of {pages}")
+    st.session_state['chat_pages_back'] = back
+    end = total - back * MESSAGES_PER_PAGE
+    for msg in snap.messages[max(0, end - MESSAGES_PER_PAGE):end]:
+        show_message(snap, msg)
+    # where this session's view of the chat ends: the messages version it was
+    # rendered from, how many messages there were and the id of the last one
+    last = snap.messages[total - 1].get('id') if total else None
+    st.session_state['_chat_cursor'] = (snap.messages_version, total, last)
+    follow_messages()
+
+# Tail-follow: every refresh renders only the messages sent after the cursor, so
+# a quiet chat costs an int compare and a busy one what's new. Anything other
+# than new messages at the end (a delete, a rewrite) redraws the whole page.
+@st.fragment(run_every=CHAT_REFRESH_SECONDS)
+def follow_messages():
+    snap = store.snapshot()
+    version, total, last = st.session_state['_chat_cursor']
+    if snap.messages_version == version:
+        return
+    count = len(snap.messages)
+    if count < total or (total and snap.messages[total - 1].get('id') != last):
+        st.rerun()
+    if count - total > MESSAGES_PER_PAGE:
+        st.rerun()  # start a fresh newest page rather than grow this one
+    if st.session_state.get('chat_pages_back', 0):
+        if count > total:
+            st.caption(f"{count - total} new message(s) on the newest page")
+        return
+    for msg in snap.messages[total:count]:
+        show_message(snap, msg)
+
+show_messages()
+
+# Bookings drive the calendar, the detail view and the form, so when another
+# session changes them the whole page reruns. Otherwise this is just an int compare.
+@st.fragment(run_every=CHAT_REFRESH_SECONDS)
+def watch_bookings():
+    if store.snapshot().bookings_version != st.session_state.get('_bookings_seen'):
+        st.rerun()
+
+watch_bookings()
+
 # ==========================
 # --- Schedule Play Dates ---
 # ==========================
 st.header("Schedule Play Dates")
-today = datetime.today()
-selected_month = st.slider("Select Month", 1, 12, today.month)
-selected_year = st.slider("Select Year", today.year - 1, today.year + 1, today.year)
-
-cal_matrix = calendar.monthcalendar(selected_year, selected_month)
-st.subheader(f"{calendar.month_name[selected_month]} {selected_year}")
 
 if 'selected_date' not in st.session_state:
     st.session_state['selected_date'] = None
 if 'view_bookings_for_date' not in st.session_state:
     st.session_state['view_bookings_for_date'] = None
 
-# Prepare date status sets
-blocked_dates = set()
-pending_dates = set()
-confirmed_dates = set()
-
-for b in bookings:
-    date_str = b['date']
-    status = b.get('status', 'Pending')
-    if status == 'Blocked':
-        blocked_dates.add(date_str)
-    elif status == 'Pending':
-        pending_dates.add(date_str)
-    elif status == 'Confirmed':
-        confirmed_dates.add(date_str)
-
-def get_date_icon(date_str):
-    if date_str in blocked_dates:
-        return '🔴'
-    elif date_str in pending_dates:
-        return '🔵'
-    elif date_str in confirmed_dates:
-        return '🟢'
+# Status sets, time indexes and per-day occupancy all live in the shared snapshot
+held_index = snap.held_index
+pending_index = snap.pending_index
+held_days = snap.held_days
+
+today = datetime.today()
+selected_month = st.slider("Select Month", 1, 12, today.month)
+selected_year = st.slider("Select Year", today.year - 1, today.year + 1, today.year)
+
+# Availability search over the precomputed per-day occupancy
+with st.expander("Find free dates"):
+    col1, col2, col3, col4 = st.columns(4)
+    search_from = col1.date_input("From", today.date())
+    search_to = col2.date_input("To", today.date() + timedelta(days=365))
+    how_many = col3.number_input("How many", min_value=1, max_value=50, value=5)
+    slot_minutes = col4.number_input("Slot (minutes, 0 = whole day)", min_value=0,
+                                     max_value=720, value=0, step=15)
+    if slot_minutes:
+        free = [(d.isoformat(), f"{d.strftime('%a %b %d, %Y')} at {t}")
+                for d, t in next_free_slots(held_index, search_from, search_to,
+                                            how_many, slot_minutes)]
     else:
-        return ''
-
-# Display calendar with icons
-for week in cal_matrix:
-    cols = st.columns(7)
-    for i, day in enumerate(week):
-        if day == 0:
-            cols[i].write(" ")
-        else:
-            date_str = f"{selected_year}-{selected_month:02d}-{day:02d}"
-            icon = get_date_icon(date_str)
-            label = f"{day} {icon}"
-            btn = cols[i].button(label, key=f"date_{date_str}")
-            if btn:
-                st.session_state['selected_date'] = date_str
-                st.session_state['view_bookings_for_date'] = date_str
+        free = [(d.isoformat(), d.strftime('%a %b %d, %Y'))
+                for d in next_free_dates(held_days, search_from, search_to, how_many)]
+    if not free:
+        st.write("Nothing free in that range.")
+    for i, (date_str, label) in enumerate(free):
+        if st.button(label, key=f"free_{i}_{date_str}"):
+            st.session_state['selected_date'] = date_str
+            st.session_state['view_bookings_for_date'] = date_str
+
+# Bulk import (holiday blocks, recurring events): validated, then one write
+with st.expander("Import bookings (CSV / NDJSON)"):
+    with st.form("import_form", clear_on_submit=True):
+        upload = st.file_uploader("Bookings file", type=['csv', 'ndjson', 'jsonl'])
+        st.caption("Columns: date, time, parent, child, and optionally duration, "
+                   "status, reason, notes.")
+        entered_pin = st.text_input("Enter PIN", type='password')
+        if st.form_submit_button("Import") and upload is not None:
+            if entered_pin != pin_code:
+                st.error("Incorrect PIN")
+            else:
+                imported, errors, duplicates, took = import_bytes(upload.getvalue(),
+                                                                guess_format(upload.name))
+                st.success(f"Imported {len(imported)} booking(s) in {took:.2f}s.")
+                if duplicates:
+                    st.warning(f"Skipped {len(duplicates)} duplicate(s).")
+                for where, reason in errors[:20]:
+                    st.error(f"Line {where}: {reason}")
+
+st.subheader(f"{calendar.month_name[selected_month]} {selected_year}")
+
+# Display calendar with icons: one component, fed the status flags per day from
+# the table all server processes share
+clicked = month_calendar(selected_year, selected_month,
+                         store.month_codes(selected_year, selected_month),
+                         selected=st.session_state['selected_date'], key='calendar')
+if clicked:
+    st.session_state['selected_date'] = clicked
+    st.session_state['view_bookings_for_date'] = clicked
+
+# Calendar feed for phone calendar apps (cached until bookings change)
+ics_etag, ics_body = ics.calendar_bytes(snap)
+st.download_button("📅 Add play dates to your calendar (.ics)", ics_body,
+                   file_name='club-selene.ics', mime='text/calendar')
 
 # Show bookings for selected date
 if st.session_state.get('view_bookings_for_date'):
     selected_date = st.session_state['view_bookings_for_date']
-    date_bookings = [b for b in bookings if b['date'] == selected_date]
+    date_bookings = snap.bookings_on(selected_date)
     st.subheader(f"Bookings for {selected_date}")
     if date_bookings:
         for b in date_bookings:
@@ -161,10 +309,13 @@ if st.session_state.get('view_bookings_for_date'):
             elif status == 'Confirmed':
                 color = 'green'
             st.markdown(
-                f"**Child:** {b['child']} | **Parent:** {b['parent']} | **Time:** {b['time']} | "
-                f"**Status:** <span style='color:{color};'>{status}</span>",
+                f"**Child:** {b['child']} | **Parent:** {b['parent']} | **Time:** {format_interval(b)} | "
+                f"**Status:** <span style='color:{color};'>{status}</span> | "
+                f"**Reason:** {b.get('reason', 'Play date')}",
                 unsafe_allow_html=True
             )
+            if b.get('notes'):
+                st.caption(f"Notes: {b['notes']}")
 #            st.write(f"**Child:** {b['child']} | **Parent:** {b['parent']} | **Time:** {b['time']}")
 #            st.markdown(f"**Status:** {status}", unsafe_allow_html=False)
             
@@ -187,11 +338,7 @@ if st.session_state.get('view_bookings_for_date'):
                 if st.button(f"Submit Confirm {b['id']}"):
                     if entered_pin == pin_code:
                         # Update status
-                        for orig_b in bookings:
-                            if orig_b['id'] == b['id']:
-                                orig_b['status'] = 'Confirmed'
-                                break
-                        save_data(bookings, BOOKINGS_FILE)
+                        store.set_booking_status(b['id'], 'Confirmed')
                         st.success("Booking confirmed.")
                         # Reset flags
                         st.session_state.pop(f"pin_needed_confirm_{b['id']}", None)
@@ -215,11 +362,7 @@ if st.session_state.get('view_bookings_for_date'):
                 if st.button(f"Submit Deny {b['id']}"):
                     if entered_pin == pin_code:
                         # Update status
-                        for orig_b in bookings:
-                            if orig_b['id'] == b['id']:
-                                orig_b['status'] = 'Blocked'
-                                break
-                        save_data(bookings, BOOKINGS_FILE)
+                        store.set_booking_status(b['id'], 'Blocked')
                         st.success("Booking denied.")
                         # Reset flags
                         st.session_state.pop(f"pin_needed_deny_{b['id']}", None)
@@ -229,29 +372,110 @@ if st.session_state.get('view_bookings_for_date'):
     else:
         st.write("No bookings for this date.")
 
+    # Bulk Confirm / Deny: one PIN check and one write for the whole batch
+    month_prefix = selected_date[:7]
+    month_label = datetime.strptime(month_prefix, '%Y-%m').strftime('%B %Y')
+    with st.expander("Bulk confirm / deny"):
+        with st.form("bulk_form", clear_on_submit=True):
+            scope = st.radio("Apply to", ["Selected bookings",
+                                          f"All pending on {selected_date}",
+                                          f"All pending in {month_label}"])
+            chosen = st.multiselect(
+                "Selected bookings",
+                [b['id'] for b in date_bookings],
+                format_func=lambda bid: next(
+                    f"{b['child']} ({b['parent']}, {format_interval(b)}, {b.get('status', 'Pending')})"
+                    for b in date_bookings if b['id'] == bid)
+            )
+            action = st.radio("Action", ["Confirm", "Deny"], horizontal=True)
+            entered_pin = st.text_input("Enter PIN", type='password')
+            if st.form_submit_button("Apply"):
+                if entered_pin != pin_code:
+                    st.error("Incorrect PIN")
+                else:
+                    if scope == "Selected bookings":
+                        ids = chosen
+                    elif scope.startswith("All pending on"):
+                        ids = [b['id'] for b in date_bookings
+                               if b.get('status', 'Pending') == 'Pending']
+                    else:
+                        ids = [b['id'] for date_str, day in snap.by_date.items()
+                               if str(date_str).startswith(month_prefix)
+                               for b in day if b.get('status', 'Pending') == 'Pending']
+                    new_status = 'Confirmed' if action == "Confirm" else 'Blocked'
+                    changed = store.set_booking_statuses(ids, new_status)
+                    st.success(f"{changed} booking(s) {'confirmed' if action == 'Confirm' else 'denied'}.")
+
 # ==========================
 # -- Booking Request Form --
 # ==========================
+show_notices("booking_form")
 if st.session_state.get('selected_date'):
     booking_date = st.session_state['selected_date']
     st.subheader(f"Book Play Date on {booking_date}")
-    with st.form("booking_form"):
+    with st.form(f"booking_form_{form_token('booking_form')}"):
         parent_name = st.text_input("Parent's Name")
         child_name = st.text_input("Child's Name")
         time_slot = st.time_input("Preferred Time")
-        if st.form_submit_button("Submit Booking"):
+        duration = st.number_input("Duration (minutes)", min_value=15, max_value=720,
+                                   value=DEFAULT_DURATION, step=15)
+        reason = st.text_input("Reason / Event", value="Play date")
+        notes = st.text_area("Notes (e.g. if you'd like us to come to you)")
+        submitted = st.form_submit_button("Submit Booking")
+        key = submit_key("booking_form", booking_date, parent_name, child_name,
+                         time_slot, duration, reason, notes)
+        if submitted:
             new_booking = {
                 "id": str(uuid.uuid4()),
                 "parent": parent_name,
                 "child": child_name,
                 "date": booking_date,
                 "time": str(time_slot),
+                "duration": int(duration),
+                "reason": reason or "Play date",
+                "notes": notes,
                 "status": "Pending"
             }
-            bookings.append(new_booking)
-            save_data(bookings, BOOKINGS_FILE)
-            st.success("Play date booked! Await confirmation.")
-            # Reset selected date
-            st.session_state['selected_date'] = None
-            st.session_state['view_bookings_for_date'] = None
+            start, end = booking_interval(new_booking)
+            if store.earlier(key) is not None:
+                st.info("That booking request was already sent.")
+            elif held_index.overlaps(booking_date, start, end):
+                st.error(f"{format_interval(new_booking)} on {booking_date} is already taken. "
+                         "Please pick another time.")
+            elif not throttle.allow('booking', session_id, parent_name)[0]:
+                st.error("Too many booking requests at once, please wait a minute and try again.")
+            elif not store.add_booking(new_booking, key):
+                st.info("That booking request was already sent.")
+            else:
+                notices = [("success", "Play date booked! Await confirmation.")]
+                if pending_index.overlaps(booking_date, start, end):
+                    notices.append(("warning",
+                                    "Heads up: another request for this time is still pending."))
+                # Reset selected date
+                st.session_state['selected_date'] = None
+                st.session_state['view_bookings_for_date'] = None
+                written("booking_form", *notices)
+
+# ==========================
+# -- Export --
+# ==========================
+with st.expander("Export data"):
+    col1, col2 = st.columns(2)
+    export_kind = col1.selectbox("What", ["messages", "bookings"])
+    export_format = col2.selectbox("Format", ["csv", "ndjson"])
+    # only build the file when asked for
+    if st.button("Prepare export"):
+        st.download_button(f"Download {export_kind}.{export_format}",
+                           export.export_bytes(snap, export_kind, export_format),
+                           file_name=f"club-selene-{export_kind}.{export_format}",
+                           mime='text/csv' if export_format == 'csv' else 'application/x-ndjson')
+
+# ==========================
+# -- Server stats (?stats=1) --
+# ==========================
+if st.query_params.get('stats'):
+    with st.expander("Server stats", expanded=True):
+        st.json(metrics.snapshot())
 
+# Per-session memory sample when SELENE_MEMPROFILE is set (see memprofile.py)
+memprofile.sample(session_id, st.session_state)
@@ -0,0 +1,92 @@
+# Time to first render after a restart, cold vs warm-started (serve.py), on a
+# generated history. Each run is a fresh process so nothing is cached between runs,
+# and the sidecar files a run leaves behind (index, day table, binary snapshots)
+# are removed before the next one, so every run starts from the JSON files.
+#
+#   python bench_startup.py --messages 50000 --bookings 20000 --runs 5
+#
+# Needs streamlit (uses its AppTest harness). Works in a scratch directory.
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIDECARS = ('.selene_index.pickle', '.selene_days.bin', '.selene_messages.bin',
+            '.selene_bookings.bin')
+
+
+def make_history(folder, n_messages, n_bookings):
+    # old-shape records, like a long-running install before the schema upgrades
+    start = datetime(2020, 1, 1)
+    messages = [{'name': f"Parent {i % 40}", 'message': f"message {i}",
+                 'timestamp': (start + timedelta(minutes=17 * i)).isoformat()}
+                for i in range(n_messages)]
+    bookings = [{'date': (date(2020, 1, 1) + timedelta(days=random.randrange(2000))).isoformat(),
+                 'time': f"{random.randrange(9, 18):02d}:00:00",
+                 'parent': f"Parent {i % 40}", 'child': f"Child {i % 40}",
+                 'status': random.choice(['Pending', 'Confirmed', 'Blocked'])}
+                for i in range(n_bookings)]
+    with open(os.path.join(folder, 'chat_messages.json'), 'w') as f:
+        json.dump(messages, f)
+    with open(os.path.join(folder, 'bookings.json'), 'w') as f:
+        json.dump(bookings, f)
+
+
+def first_render(warm):
+    # runs in the child process; prints seconds to the first finished render
+    import store
+    from streamlit.testing.v1 import AppTest
+    if warm:
+        store.warm_start()  # what serve.py does before the server takes requests
+    at = AppTest.from_file('app.py', default_timeout=120)
+    at.secrets['pin_key'] = 'bench'
+    started = time.perf_counter()
+    at.run()
+    took = time.perf_counter() - started
+    if at.exception:
+        raise SystemExit(f"app failed: {at.exception}")
+    print(took)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure time to first render.")
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=('cold', 'warm'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return first_render(args.child == 'warm')
+    folder = tempfile.mkdtemp(prefix='selene-bench-')
+    try:
+        for name in os.listdir(HERE):
+            if name.endswith('.py'):
+                shutil.copy(os.path.join(HERE, name), folder)
+        shutil.copytree(os.path.join(HERE, 'calendar_component'),
+                        os.path.join(folder, 'calendar_component'))
+        make_history(folder, args.messages, args.bookings)
+        for mode in ('cold', 'warm'):
+            times = []
+            for _ in range(args.runs):
+                for name in SIDECARS:
+                    if os.path.exists(os.path.join(folder, name)):
+                        os.remove(os.path.join(folder, name))
+                out = subprocess.run([sys.executable, 'bench_startup.py', '--child', mode],
+                                     cwd=folder, capture_output=True, text=True, check=True)
+                times.append(float(out.stdout.strip().splitlines()[-1]))
+            print(f"{mode}: first render median {statistics.median(times) * 1000:.0f} ms, "
+                  f"min {min(times) * 1000:.0f} ms over {args.runs} runs")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# Binary snapshot of messages or bookings for random access through mmap: opening
+# one costs nothing however big it is, and reading record 50,000 (or the booking
+# with a given id) decodes just that record. The JSON files stay the source of
+# truth; a snapshot is stamped with the version of the file it was built from and
+# the schema version of its records, and ignored once either changes. The store
+# uses them when SELENE_BINARY_SNAPSHOT=1.
+#
+#   python binsnap.py build                     (re)build both from the JSON files
+#   python binsnap.py get messages 50000        print one record
+#   python binsnap.py find bookings <id>
+#
+# Layout (little-endian):
+#
+#   header      magic, format, kind, schema version, count, n_strings, string
+#               index offset, rows offset, id index offset, stamp
+#   rows        count rows of len(FIELDS[kind]) + 1 u32 string numbers (the last
+#               column holds any other keys as JSON); MISSING for an absent field
+#   strings     (n_strings + 1) u64 offsets into the blob that follows, each
+#               distinct string stored once, utf-8
+#   id index    count u32 row numbers, sorted by id
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from schema import CURRENT, LazyRecords
+
+MAGIC = b'SLBS'
+FORMAT = 4
+KINDS = ('messages', 'bookings')
+FIELDS = {
+    'messages': ('id', 'name', 'message', 'timestamp'),
+    'bookings': ('id', 'date', 'time', 'duration', 'status', 'parent', 'child',
+                 'reason', 'notes'),
+}
+INT_FIELDS = {'duration'}
+MISSING = 0xFFFFFFFF
+_HEADER = struct.Struct('<4sIIIIIQQQ48s')
+_OFFSET = struct.Struct('<Q')
+_ROW = struct.Struct('<I')
+
+
+def build(kind, records, path, stamp):
+    # records: dicts in the current schema version (CURRENT[kind]), in order
+    fields = FIELDS[kind]
+    strings = {}
+    rows = array('I')
+    ids = []
+
+    def number(value):
+        if value is None:
+            return MISSING
+        value = str(value)
+        n = strings.get(value)
+        if n is None:
+            n = strings[value] = len(strings)
+        return n
+
+    for i, record in enumerate(records):
+        for field in fields:
+            rows.append(number(record.get(field)))
+        extra = {k: v for k, v in record.items() if k not in fields and k != 'v'}
+        rows.append(number(json.dumps(extra, ensure_ascii=False)) if extra else MISSING)
+        ids.append((str(record.get('id')), i))
+    ids.sort()
+    count = len(ids)
+    if sys.byteorder != 'little':
+        rows.byteswap()
+
+    blob = bytearray()
+    offsets = array('Q')
+    for value in strings:  # insertion order is number order
+        offsets.append(len(blob))
+        blob += value.encode('utf-8')
+    offsets.append(len(blob))
+    id_index = array('I', (i for _, i in ids))
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+        id_index.byteswap()
+
+    rows_at = _HEADER.size
+    strings_at = rows_at + len(rows) * 4
+    ids_at = strings_at + len(offsets) * 8 + len(blob)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT, KINDS.index(kind), CURRENT[kind], count,
+                             len(strings), strings_at, rows_at, ids_at,
+                             stamp.encode()[:48]))
+        f.write(rows.tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+        f.write(id_index.tobytes())
+    os.replace(tmp, path)
+
+
+class BinaryRecords:
+    # Read-only sequence over a binary snapshot. Records are decoded when read, so
+    # treat them like any other snapshot record: never change them in place.
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, fmt, kind, schema, self._count, self._n_strings, self._strings_at,
+         self._rows_at, self._ids_at, stamp) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError(f"{path} isn't a binary snapshot")
+        self.kind = KINDS[kind]
+        # records in an older shape would skip the upgraders: build it again
+        if schema != CURRENT[self.kind]:
+            raise ValueError(f"{path} has {self.kind} v{schema}, not v{CURRENT[self.kind]}")
+        self.schema = schema
+        self.stamp = stamp.rstrip(b'\0').decode()
+        self._fields = FIELDS[self.kind]
+        self._row = struct.Struct(f"<{len(self._fields) + 1}I")
+        self._blob_at = self._strings_at + (self._n_strings + 1) * 8
+
+    def _string(self, n):
+        start, = _OFFSET.unpack_from(self._map, self._strings_at + n * 8)
+        end, = _OFFSET.unpack_from(self._map, self._strings_at + n * 8 + 8)
+        return self._map[self._blob_at + start:self._blob_at + end].decode('utf-8')
+
+    def _record(self, i):
+        numbers = self._row.unpack_from(self._map, self._rows_at + i * self._row.size)
+        record = {}
+        for field, n in zip(self._fields, numbers):
+            if n != MISSING:
+                value = self._string(n)
+                record[field] = _number(value) if field in INT_FIELDS else value
+        if numbers[-1] != MISSING:
+            record.update(json.loads(self._string(numbers[-1])))
+        record['v'] = self.schema
+        return record
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._record(j) for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._record(i)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._record(i)
+
+    def __add__(self, other):
+        # a change: from here on it's an ordinary in-memory list
+        return LazyRecords(self.kind, list(self)) + other
+
+    def find(self, record_id):
+        # binary search of the id index: reads about log2(n) ids
+        record_id = str(record_id)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row, = _ROW.unpack_from(self._map, self._ids_at + mid * 4)
+            n = self._row.unpack_from(self._map, self._rows_at + row * self._row.size)[0]
+            if (self._string(n) if n != MISSING else 'None') < record_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count:
+            row, = _ROW.unpack_from(self._map, self._ids_at + lo * 4)
+            record = self._record(row)
+            if str(record.get('id')) == record_id:
+                return record
+        return None
+
+
+def _number(value):
+    # stored as str(); give back what JSON would have: 90, 90.0, or text as written
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def open_records(path, stamp=None):
+    # the snapshot at path, or None if it's missing, broken or not built from the
+    # file version `stamp`
+    try:
+        records = BinaryRecords(path)
+    except (OSError, ValueError):
+        return None
+    if stamp is not None and records.stamp != stamp:
+        return None
+    return records
+
+
+def main(argv=None):
+    import store
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['build']:
+        store.save_binary(force=True)
+        for kind in KINDS:
+            print(f"{kind}: {len(open_records(store.BINARY_FILES[kind]))} records "
+                  f"-> {store.BINARY_FILES[kind]}")
+        return 0
+    if len(argv) == 3 and argv[0] in ('get', 'find') and argv[1] in KINDS:
+        records = open_records(store.BINARY_FILES[argv[1]])
+        if records is None:
+            print("no binary snapshot, run: python binsnap.py build", file=sys.stderr)
+            return 1
+        record = records[int(argv[2])] if argv[0] == 'get' else records.find(argv[2])
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+        return 0 if record is not None else 1
+    print(__doc__ if __doc__ else "usage: binsnap.py build | get KIND N | find KIND ID",
+          file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
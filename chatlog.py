@@ -0,0 +1,190 @@
+# The chat as a log, one JSON message per line (chat_messages.ndjson), for
+# SELENE_CHAT_LOG=1. Sending a message appends a line instead of rewriting the
+# file, and a sparse index (every INDEX_EVERY-th line's byte offset and timestamp)
+# lets the chat view reach any page or date by seeking straight to it, reading at
+# most INDEX_EVERY lines, however long the history is.
+#
+#   python chatlog.py convert            chat_messages.json -> chat_messages.ndjson
+#   python chatlog.py get 50000          print one message
+#   python chatlog.py at 2024-03-01      position of the first message from then on
+#
+# Only deleting a message rewrites the file (to a temp file renamed over it).
+# Timestamps are assumed to go up through the file, as they do for messages
+# appended as they're sent; finding a date relies on it.
+import bisect
+import json
+import mmap
+import os
+import sys
+from array import array
+
+from schema import LazyRecords, upgrade
+
+INDEX_EVERY = 64
+LOG_FILE = 'chat_messages.ndjson'
+
+
+class ChatLog:
+    # Read-only sequence over the log as it was when opened: lines appended later
+    # aren't seen (extended() gives a log that has them), and a rewrite replaces
+    # the file, leaving this mapping on the old one.
+
+    def __init__(self, path, _base=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._file = (stat.st_dev, stat.st_ino)
+            size = stat.st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if _base is None:
+            self._offsets = array('Q')  # byte offset of every INDEX_EVERY-th line
+            self._times = []  # ... and its timestamp
+            self._count = 0
+            self._scan(0)
+        else:
+            self._offsets = array('Q', _base._offsets)
+            self._times = list(_base._times)
+            self._count = _base._count
+            self._scan(_base.size)
+
+    def _scan(self, at):
+        # index whole lines from byte `at` on; a partial last line is left out
+        data = self._map
+        end = len(data)
+        while at < end:
+            nl = data.find(b'\n', at)
+            if nl < 0:
+                break
+            if nl > at:
+                if self._count % INDEX_EVERY == 0:
+                    self._offsets.append(at)
+                    self._times.append(_timestamp(data[at:nl]))
+                self._count += 1
+            at = nl + 1
+        self.size = at
+
+    def is_start_of(self, path):
+        # True when path is still this file and hasn't lost anything we indexed,
+        # i.e. it has only been appended to since
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (stat.st_dev, stat.st_ino) == self._file and stat.st_size >= self.size
+
+    def extended(self):
+        # the same log including lines appended since it was opened
+        return ChatLog(self.path, _base=self)
+
+    def _line_at(self, i):
+        # byte offset of line i: seek to its block, then step over the lines before it
+        at = self._offsets[i // INDEX_EVERY]
+        for _ in range(i % INDEX_EVERY):
+            at = self._next(at)
+        return at
+
+    def _next(self, at):
+        at = self._map.find(b'\n', at) + 1
+        while self._map[at:at + 1] == b'\n':  # blank lines
+            at += 1
+        return at
+
+    def _decode(self, at, i):
+        # i: the line's position, for records that need an id made up
+        return upgrade('messages', json.loads(self._map[at:self._map.find(b'\n', at)]), i)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._count)
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            records = []
+            at = self._line_at(start) if start < stop else 0
+            for j in range(start, stop):
+                records.append(self._decode(at, j))
+                at = self._next(at)
+            return records
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._decode(self._line_at(i), i)
+
+    def __iter__(self):
+        at = self._offsets[0] if self._offsets else 0
+        for i in range(self._count):
+            yield self._decode(at, i)
+            at = self._next(at)
+
+    def __add__(self, other):
+        return LazyRecords('messages', list(self)) + other
+
+    def index_at(self, timestamp):
+        # position of the first message at or after timestamp (an ISO string)
+        block = max(0, bisect.bisect_left(self._times, timestamp) - 1)
+        i = block * INDEX_EVERY
+        at = self._offsets[block] if self._offsets else 0
+        while i < self._count and _timestamp(self._map[at:self._map.find(b'\n', at)]) < timestamp:
+            i += 1
+            at = self._next(at)
+        return i
+
+
+def _timestamp(line):
+    try:
+        return json.loads(line).get('timestamp') or ''
+    except (ValueError, AttributeError):
+        return ''
+
+
+def _lines(records):
+    return ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8')
+
+
+def append(log, records):
+    # Write records at the end of the file `log` was opened on and return the
+    # extended log. Call with the exclusive chat lock held.
+    with open(log.path, 'r+b') as f:
+        # drop anything past what we indexed: half a line from a writer that died
+        f.truncate(log.size)
+        f.seek(log.size)
+        f.write(_lines(records))
+        f.flush()
+        os.fsync(f.fileno())
+    return log.extended()
+
+
+def write(path, records):
+    # the whole log, replaced atomically; call with the exclusive chat lock held
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_lines(records))
+    os.replace(tmp, path)
+    return ChatLog(path)
+
+
+def main(argv=None):
+    import store
+    argv = sys.argv[1:] if argv is None else argv
+    if argv == ['convert']:
+        legacy = os.path.join(store.DATA_DIR, 'chat_messages.json')
+        log = write(os.path.join(store.DATA_DIR, LOG_FILE),
+                    LazyRecords('messages', store.load_data(legacy)))
+        print(f"{len(log)} messages -> {log.path}")
+        return 0
+    if len(argv) == 2 and argv[0] in ('get', 'at'):
+        log = ChatLog(os.path.join(store.DATA_DIR, LOG_FILE))
+        if argv[0] == 'get':
+            print(json.dumps(log[int(argv[1])], ensure_ascii=False, indent=2))
+        else:
+            print(log.index_at(argv[1]))
+        return 0
+    print("usage: chatlog.py convert | get N | at DATE", file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# Per-day booking status codes in a memory-mapped file that every server process
+# on the machine maps, so the calendar's status icons are computed once by the
+# process that changes the bookings and read in place by all the others.
+#
+# One byte per day from FIRST_DAY on, OR-ed status flags (PENDING | CONFIRMED |
+# BLOCKED), behind a small header:
+#
+#   magic  format  sequence  stamp
+#   4s     I       Q         48s      (little-endian, 64 bytes)
+#
+# The writer holds the exclusive bookings lock (store._changing), makes the
+# sequence odd, changes the bytes and the stamp (the bookings file version the
+# table matches), then makes it even again. Readers retry while the sequence is
+# odd or moved during their read, so they never see a half-done update and never
+# take a lock. sequence // 2 is the table's version.
+import mmap
+import os
+import struct
+from datetime import date, timedelta
+
+PENDING, CONFIRMED, BLOCKED = 1, 2, 4
+CODES = {'Pending': PENDING, 'Confirmed': CONFIRMED, 'Blocked': BLOCKED}
+
+MAGIC = b'SLDT'
+FORMAT = 1
+_HEADER = struct.Struct('<4sIQ48s')
+_SEQ = struct.Struct('<Q')
+_SEQ_AT = 8
+FIRST_DAY = date(2000, 1, 1).toordinal()
+N_DAYS = 100 * 366
+SIZE = _HEADER.size + N_DAYS
+
+
+def day_code(bookings):
+    code = 0
+    for b in bookings:
+        code |= CODES.get(b.get('status', 'Pending'), 0)
+    return code
+
+
+def _slot(date_str):
+    # byte offset of a date, or None outside the table
+    try:
+        i = date.fromisoformat(date_str).toordinal() - FIRST_DAY
+    except (TypeError, ValueError):
+        return None
+    return _HEADER.size + i if 0 <= i < N_DAYS else None
+
+
+class DayTable:
+    # create=True only under the exclusive bookings lock: it may reset the file
+    def __init__(self, path, create=False):
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                if not create:
+                    raise ValueError(f"{path} isn't set up yet")
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, SIZE)
+            self._map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        magic, fmt, seq, stamp = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            if not create:
+                raise ValueError(f"{path} has another format")
+            # an empty stamp never matches, so the first writer fills it in
+            self._map[:SIZE] = bytes(SIZE)
+            _HEADER.pack_into(self._map, 0, MAGIC, FORMAT, 0, b'')
+
+    # ---- reading, from any process ----
+
+    def _read(self, read, tries=10000):
+        # None if a writer never finishes (it died mid-update; the next one repairs it)
+        for _ in range(tries):
+            before = _SEQ.unpack_from(self._map, _SEQ_AT)[0]
+            if before % 2:
+                continue
+            value = read()
+            if _SEQ.unpack_from(self._map, _SEQ_AT)[0] == before:
+                return value
+        return None
+
+    def version(self):
+        return _SEQ.unpack_from(self._map, _SEQ_AT)[0] // 2
+
+    def stamp(self):
+        # only meaningful to the writer, which holds the lock; odd sequence or not
+        return _HEADER.unpack_from(self._map, 0)[3].rstrip(b'\0').decode()
+
+    def _read_for(self, stamp, read):
+        # read() when the table matches the bookings file version `stamp` (checked
+        # in the same consistent read), else None
+        if stamp is None:
+            return self._read(read)
+        stamp = stamp.encode().ljust(48, b'\0')[:48]
+        return self._read(lambda: read() if self._map[16:64] == stamp else None)
+
+    def code(self, date_str, stamp=None):
+        # status flags for a date, or None when it's outside the table (or the
+        # table doesn't match `stamp`)
+        at = _slot(date_str)
+        if at is None:
+            return None
+        return self._read_for(stamp, lambda: self._map[at])
+
+    def codes(self, date_str, n, stamp=None):
+        # status flags for n days from date_str, in one read; None as for code()
+        at = _slot(date_str)
+        if at is None or _slot((date.fromisoformat(date_str) + timedelta(days=n - 1))
+                               .isoformat()) is None:
+            return None
+        return self._read_for(stamp, lambda: self._map[at:at + n])
+
+    # ---- writing, under the exclusive bookings lock ----
+
+    def _write(self, changes, stamp):
+        seq = _SEQ.unpack_from(self._map, _SEQ_AT)[0]
+        seq += seq % 2  # left odd by a writer that died
+        _SEQ.pack_into(self._map, _SEQ_AT, seq + 1)
+        # no stamp while changing, so if we die here the next writer rebuilds
+        self._map[16:64] = bytes(48)
+        changes()
+        self._map[16:64] = stamp.encode().ljust(48, b'\0')[:48]
+        _SEQ.pack_into(self._map, _SEQ_AT, seq + 2)
+
+    def update(self, by_date, dates, stamp):
+        # recompute the given dates from a date -> bookings mapping
+        def changes():
+            for d in dates:
+                at = _slot(d)
+                if at is not None:
+                    self._map[at] = day_code(by_date.get(d, ()))
+        self._write(changes, stamp)
+
+    def rebuild(self, by_date, stamp):
+        codes = bytearray(N_DAYS)
+        for d, bookings in by_date.items():
+            at = _slot(d)
+            if at is not None:
+                codes[at - _HEADER.size] = day_code(bookings)
+
+        def changes():
+            self._map[_HEADER.size:SIZE] = bytes(codes)
+        self._write(changes, stamp)
+
+
+def open_table(path, create=False):
+    # None where it isn't usable (yet); callers fall back to the snapshot
+    try:
+        return DayTable(path, create)
+    except (OSError, ValueError):
+        return None
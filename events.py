@@ -0,0 +1,42 @@
+# Small in-process publish/subscribe bus for chat and booking changes.
+# Save paths in store.py publish, metrics subscribe.
+import threading
+import time
+from collections import namedtuple
+
+MESSAGE_ADDED = 'message_added'
+MESSAGE_DELETED = 'message_deleted'
+BOOKING_ADDED = 'booking_added'
+BOOKING_STATUS_CHANGED = 'booking_status_changed'
+
+EVENT_KINDS = (MESSAGE_ADDED, MESSAGE_DELETED, BOOKING_ADDED, BOOKING_STATUS_CHANGED)
+
+# data is the new record for *_added, {'id'} for message_deleted and
+# {'id', 'date', 'old_status', 'status'} for booking_status_changed
+Event = namedtuple('Event', ['kind', 'data', 'time'])
+
+
+class EventBus:
+    def __init__(self):
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, kind, callback):
+        # callback(event) runs synchronously on the publishing thread
+        with self._lock:
+            self._callbacks.setdefault(kind, []).append(callback)
+
+    def publish(self, kind, data):
+        event = Event(kind, data, time.time())
+        with self._lock:
+            callbacks = list(self._callbacks.get(kind, ()))
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                pass
+        return event
+
+
+# one bus per server process
+bus = EventBus()
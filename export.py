@@ -0,0 +1,93 @@
+# CSV / NDJSON export of messages and bookings, produced in chunks.
+#
+#   python export.py messages csv -o messages.csv
+#   python export.py bookings ndjson > bookings.ndjson
+#
+# Only the CLI streams: it reads the data file record by record and writes each
+# chunk as it goes, so the export never sits in memory at once. The app's download
+# button exports the current shared snapshot, and st.download_button needs the
+# whole payload, so export_bytes joins the chunks into one bytes.
+import argparse
+import csv
+import io
+import json
+import sys
+
+from migrate import iter_json_array
+from schema import upgrade
+import store
+
+FIELDS = {
+    'messages': ['id', 'name', 'message', 'timestamp'],
+    'bookings': ['id', 'date', 'time', 'duration', 'status', 'parent', 'child',
+                 'reason', 'notes'],
+}
+FORMATS = ('csv', 'ndjson')
+CHUNK_RECORDS = 500
+
+
+def iter_csv(records, fields):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fields, extrasaction='ignore')
+    writer.writeheader()
+    for n, record in enumerate(records, 1):
+        writer.writerow(record)
+        if n % CHUNK_RECORDS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def iter_ndjson(records):
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) >= CHUNK_RECORDS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_export(records, kind, fmt):
+    if fmt == 'csv':
+        return iter_csv(records, FIELDS[kind])
+    return iter_ndjson(records)
+
+
+def iter_file_records(kind):
+    path = store.CHAT_FILE if kind == 'messages' else store.BOOKINGS_FILE
+    if kind == 'messages' and store.USE_CHAT_LOG:
+        yield from store.load_messages()  # one line at a time already
+        return
+    try:
+        for i, (record, offset) in enumerate(iter_json_array(path)):
+            yield upgrade(kind, record, i)
+    except FileNotFoundError:
+        return
+
+
+def export_bytes(snap, kind, fmt):
+    # the whole export in memory, for st.download_button
+    records = snap.messages if kind == 'messages' else snap.bookings
+    return ''.join(iter_export(records, kind, fmt)).encode('utf-8')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export messages or bookings.")
+    parser.add_argument('kind', choices=sorted(FIELDS))
+    parser.add_argument('format', choices=FORMATS)
+    parser.add_argument('-o', '--out', help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+    out = open(args.out, 'w', newline='', encoding='utf-8') if args.out else sys.stdout
+    try:
+        for chunk in iter_export(iter_file_records(args.kind), args.kind, args.format):
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
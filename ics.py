@@ -0,0 +1,171 @@
+# iCalendar (.ics) feed for phone calendar apps: Confirmed play dates as events,
+# Blocked ones as busy time. The feed is generated as a stream and the finished
+# result is cached under an ETag taken from the bookings file version, so repeat
+# subscription fetches cost nothing until the bookings actually change.
+#
+#   python ics.py --port 8502          serve http://127.0.0.1:8502/calendar.ics
+#   python ics.py club-selene.ics      write it out once
+import argparse
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from schedule import DAY_MINUTES, booking_interval
+import store
+
+CALENDAR_NAME = 'Club Selene'
+DEFAULT_PORT = 8502
+
+_cache = {}  # etag -> finished feed; only the latest is kept
+_cache_lock = threading.Lock()
+
+
+def etag(snap):
+    return f'"ics-{snap.stamps.get("bookings", "0")}"'
+
+
+def _escape(text):
+    return (str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    # content lines are limited to 75 octets; continuation lines start with a space
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    while data:
+        size = 75 if not parts else 74
+        # don't split a multi-byte character
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(data[:size].decode('utf-8'))
+        data = data[size:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _stamp(day, minutes):
+    day = day + timedelta(days=minutes // DAY_MINUTES)
+    minutes %= DAY_MINUTES
+    return f"{day.strftime('%Y%m%d')}T{minutes // 60:02d}{minutes % 60:02d}00"
+
+
+def iter_ics(bookings):
+    # yields the feed one event at a time
+    now = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield ('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Club Selene//Play dates//EN\r\n'
+           'CALSCALE:GREGORIAN\r\nMETHOD:PUBLISH\r\n' + _fold(f"X-WR-CALNAME:{CALENDAR_NAME}"))
+    for b in bookings:
+        status = b.get('status', 'Pending')
+        if status not in ('Confirmed', 'Blocked'):
+            continue
+        interval = booking_interval(b)
+        try:
+            day = date.fromisoformat(b['date'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if interval is None:
+            continue
+        lines = ['BEGIN:VEVENT',
+                 f"UID:{b.get('id')}@club-selene",
+                 f"DTSTAMP:{now}",
+                 f"DTSTART:{_stamp(day, interval[0])}",
+                 f"DTEND:{_stamp(day, interval[1])}",
+                 'TRANSP:OPAQUE']
+        if status == 'Confirmed':
+            lines.append(f"SUMMARY:{_escape(b.get('reason') or 'Play date')}: {_escape(b.get('child', ''))}")
+            description = f"Parent: {b.get('parent', '')}"
+            if b.get('notes'):
+                description += f"\nNotes: {b['notes']}"
+            lines.append(f"DESCRIPTION:{_escape(description)}")
+            lines.append('STATUS:CONFIRMED')
+        else:
+            lines.append('SUMMARY:Busy')
+            lines.append('CLASS:PRIVATE')
+        lines.append('END:VEVENT')
+        yield ''.join(_fold(line) for line in lines)
+    yield 'END:VCALENDAR\r\n'
+
+
+def stream_calendar(snap):
+    # yields encoded chunks; a finished run is cached for its ETag
+    tag = etag(snap)
+    body = _cache.get(tag)
+    if body is not None:
+        yield body
+        return
+    parts = []
+    for chunk in iter_ics(snap.bookings):
+        data = chunk.encode('utf-8')
+        parts.append(data)
+        yield data
+    with _cache_lock:
+        _cache.clear()
+        _cache[tag] = b''.join(parts)
+
+
+def calendar_bytes(snap):
+    # (etag, whole feed), for the app's download button
+    return etag(snap), b''.join(stream_calendar(snap))
+
+
+def send_calendar(handler):
+    # answers a GET on an http.server handler, with conditional GET support
+    snap = store.snapshot()
+    tag = etag(snap)
+    if tag in handler.headers.get('If-None-Match', ''):
+        handler.send_response(304)
+        handler.send_header('ETag', tag)
+        handler.end_headers()
+        return
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/calendar; charset=utf-8')
+    handler.send_header('ETag', tag)
+    handler.send_header('Cache-Control', 'no-cache')
+    cached = _cache.get(tag)
+    if cached is not None:
+        handler.send_header('Content-Length', str(len(cached)))
+    handler.end_headers()
+    if handler.command == 'HEAD':
+        return
+    for chunk in stream_calendar(snap):
+        handler.wfile.write(chunk)
+
+
+class CalendarHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] in ('/', '/calendar.ics'):
+            send_calendar(self)
+        else:
+            self.send_error(404)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=DEFAULT_PORT, host='127.0.0.1'):
+    store.start_watching()
+    server = ThreadingHTTPServer((host, port), CalendarHandler)
+    print(f"serving http://{host}:{port}/calendar.ics")
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Club Selene calendar feed.")
+    parser.add_argument('out', nargs='?', help="write the feed to this file and exit")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args(argv)
+    if args.out:
+        with open(args.out, 'wb') as f:
+            for chunk in stream_calendar(store.snapshot()):
+                f.write(chunk)
+    else:
+        serve(args.port, args.host)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Bulk import of bookings (holiday blocks, recurring events, ...) from CSV or NDJSON.
+# Everything is validated first and then committed in one write to bookings.json.
+#
+#   python import_bookings.py holidays.csv
+#   python import_bookings.py events.ndjson --dry-run
+#
+# CSV needs a header row. Columns: date, time, parent, child, and optionally
+# duration, status (Pending / Confirmed / Blocked), reason, notes, id. Files are
+# read as UTF-8, or as Windows-1252 (what Excel saves) when they aren't UTF-8.
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+from records import normalize_booking
+import store
+
+FORMATS = ('csv', 'ndjson')
+
+
+def guess_format(name):
+    return 'ndjson' if name.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def read_rows(f, fmt):
+    # yields (line number, row dict) from a text file object
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for n, line in enumerate(f, 1):
+        line = line.strip()
+        if line:
+            try:
+                yield n, json.loads(line)
+            except ValueError as e:
+                yield n, ValueError(f"bad JSON: {e}")
+
+
+def _dup_key(b):
+    return (b['date'], b['time'], b['parent'].lower(), b['child'].lower())
+
+
+def prepare(rows, snap):
+    # -> (bookings to add, [(row, reason)] errors, [(row, reason)] duplicates)
+    existing_ids = {b.get('id') for b in snap.bookings}
+    seen = {_dup_key(b) for b in snap.bookings if b.get('date') and b.get('parent') is not None
+            and b.get('child') is not None and b.get('time')}
+    bookings, errors, duplicates = [], [], []
+    for n, (line, row) in enumerate(rows, 1):
+        where = line or n
+        if isinstance(row, Exception):
+            errors.append((where, str(row)))
+            continue
+        if not isinstance(row, dict):
+            errors.append((where, "not an object"))
+            continue
+        try:
+            # strip empty CSV cells so the normalizer's defaults apply
+            b = normalize_booking({k: v for k, v in row.items() if v not in (None, '')})
+        except ValueError as e:
+            errors.append((where, str(e)))
+            continue
+        key = _dup_key(b)
+        if key in seen or b['id'] in existing_ids:
+            duplicates.append((where, f"{b['date']} {b['time']} {b['child']}"))
+            continue
+        seen.add(key)
+        existing_ids.add(b['id'])
+        bookings.append(b)
+    return bookings, errors, duplicates
+
+
+def import_file(f, fmt, dry_run=False):
+    started = time.perf_counter()
+    bookings, errors, duplicates = prepare(read_rows(f, fmt), store.snapshot())
+    if not dry_run:
+        store.add_bookings(bookings)
+    return bookings, errors, duplicates, time.perf_counter() - started
+
+
+def decode(data):
+    for encoding in ('utf-8-sig', 'cp1252'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    raise ValueError("not UTF-8 or Windows-1252 text")
+
+
+def import_bytes(data, fmt, dry_run=False):
+    # a file that can't be read is one error, not a traceback
+    try:
+        text = decode(data)
+    except ValueError as e:
+        return [], [(1, str(e))], [], 0.0
+    return import_file(io.StringIO(text, newline=''), fmt, dry_run)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import bookings from CSV or NDJSON.")
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--dry-run', action='store_true', help="validate only, write nothing")
+    args = parser.parse_args(argv)
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    bookings, errors, duplicates, took = import_bytes(
+        data, args.format or guess_format(args.file), args.dry_run)
+    for where, reason in errors:
+        print(f"line {where}: {reason}", file=sys.stderr)
+    for where, what in duplicates:
+        print(f"line {where}: duplicate, skipped ({what})", file=sys.stderr)
+    verb = "would import" if args.dry_run else "imported"
+    print(f"{verb} {len(bookings)}, {len(errors)} invalid, {len(duplicates)} duplicates "
+          f"in {took:.2f}s")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# Sidecar file with a ready-built Snapshot: upgraded records, per-date lists,
+# interval indexes, held days, plus the formatted message times. It is stamped
+# with the versions of the data files it was built from, so a restart whose data
+# files haven't changed loads it instead of parsing and indexing everything again;
+# any change to either file makes it stale.
+#
+#   python index_file.py        rebuild it now (e.g. as a deploy step)
+#
+# It's a pickle written by this app next to its own data files, so it's trusted
+# the same as they are. Bump FORMAT whenever Snapshot's attributes change.
+import os
+import pickle
+import sys
+import time
+
+from schema import CURRENT
+import views
+
+INDEX_FILE = '.selene_index.pickle'
+FORMAT = 4
+
+
+def save(snap, path=INDEX_FILE):
+    state = {
+        'format': FORMAT,
+        'schema': dict(CURRENT),
+        'stamps': dict(snap.stamps),
+        'snapshot': snap,
+        'message_times': views.message_times(snap),
+    }
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load(stamps, path=INDEX_FILE):
+    # the saved Snapshot when it was built from exactly these file versions, else None
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception:
+        return None
+    if (not isinstance(state, dict) or state.get('format') != FORMAT
+            or state.get('schema') != CURRENT or state.get('stamps') != stamps):
+        return None
+    views.restore_message_times(state['message_times'])
+    return state['snapshot']
+
+
+def main(argv=None):
+    import store
+    started = time.perf_counter()
+    if os.path.exists(store.INDEX_FILE):
+        os.remove(store.INDEX_FILE)
+    snap = store.snapshot().warm()
+    save(snap, store.INDEX_FILE)
+    print(f"indexed {len(snap.messages)} messages and {len(snap.bookings)} bookings "
+          f"in {time.perf_counter() - started:.2f}s -> {store.INDEX_FILE}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# Optional memory profiler. Set SELENE_MEMPROFILE to a report path to turn it on:
+#
+#   SELENE_MEMPROFILE=memory_report.txt python serve.py
+#
+# Every session then samples its own footprint at the end of each run: the size of
+# its session_state and its widget keys grouped by prefix (pin_input_,
+# toggle_delete_, ...). The report adds the size of each part of the shared
+# snapshot (one copy for the whole process, not per session) and tracemalloc's
+# biggest allocation sites, to see what dominates near a container memory limit.
+# A background thread rewrites it every REPORT_INTERVAL seconds and at exit;
+# walking a big snapshot takes seconds, so keep the interval long.
+import atexit
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+PATH = os.environ.get('SELENE_MEMPROFILE')
+ENABLED = bool(PATH)
+REPORT_INTERVAL = 300  # seconds
+FORGET_AFTER = 3600  # drop sessions not seen for this long
+TOP_SITES = 25
+
+_lock = threading.Lock()
+_report_lock = threading.Lock()
+_sessions = {}  # session id -> sample
+_shared = (None, {})  # (snapshot version, part -> bytes)
+# widget keys end in an id or a date; group them by what comes before
+_KEY_SUFFIX = re.compile(r'[-_]?[0-9a-f]{8}-[0-9a-f-]{27}$|[-_]?\d{4}-\d{2}-\d{2}$|[-_]?\d+$')
+
+
+def deep_size(obj, seen=None):
+    # bytes held by obj and everything it references that isn't in `seen` yet
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif isinstance(o, (str, bytes, int, float, bool, type(None))):
+            continue
+        else:
+            if hasattr(o, '__dict__'):
+                stack.append(o.__dict__)
+            for name in getattr(type(o), '__slots__', ()):
+                if hasattr(o, name):
+                    stack.append(getattr(o, name))
+    return total
+
+
+def key_group(key):
+    # 'pin_input_<id>' -> 'pin_input*'
+    key = str(key)
+    m = _KEY_SUFFIX.search(key)
+    return key[:m.start()] + '*' if m else key
+
+
+def start():
+    with _lock:
+        if not ENABLED or tracemalloc.is_tracing():
+            return
+        tracemalloc.start()
+    atexit.register(write_report)
+    threading.Thread(target=_report_loop, name='selene-memprofile', daemon=True).start()
+
+
+def _report_loop():
+    while True:
+        time.sleep(REPORT_INTERVAL)
+        try:
+            write_report()
+        except Exception:
+            pass
+
+
+def sample(session_id, session_state):
+    # call at the end of a run; cheap enough to call on every one
+    if not ENABLED:
+        return
+    state = dict(session_state.to_dict() if hasattr(session_state, 'to_dict') else session_state)
+    groups = {}
+    for key, value in state.items():
+        group = groups.setdefault(key_group(key), [0, 0])
+        group[0] += 1
+        group[1] += deep_size(value)
+    with _lock:
+        _sessions[session_id] = {
+            'seen': time.time(),
+            'keys': len(state),
+            'widgets': sum(1 for key in state if not str(key).startswith('_')),
+            'bytes': deep_size(state),
+            'groups': groups,
+        }
+
+
+def shared_sizes(snap):
+    # bytes per part of the shared snapshot; records are counted in the first part
+    # that holds them, so the later parts show only their own overhead
+    global _shared
+    version, sizes = _shared
+    if version == snap.version:
+        return sizes
+    seen = set()
+    sizes = {}
+    for name in ('messages', 'bookings', 'by_date', 'held_index',
+                 'pending_index', '_held_counts', 'held_days'):
+        sizes[name] = deep_size(getattr(snap, name, None), seen)
+    from views import _human_times
+    sizes['formatted times (all versions)'] = deep_size(_human_times, seen)
+    _shared = (snap.version, sizes)
+    return sizes
+
+
+def _mb(n):
+    return f"{n / 1e6:9.2f} MB"
+
+
+def write_report(path=None):
+    path = path or PATH
+    if not path:
+        return
+    with _report_lock:
+        _write_report(path)
+
+
+def _write_report(path):
+    now = time.time()
+    with _lock:
+        for session_id in [s for s, sample in _sessions.items()
+                           if now - sample['seen'] > FORGET_AFTER]:
+            del _sessions[session_id]
+        sessions = dict(_sessions)
+    lines = [f"Club Selene memory report, {datetime.now().isoformat(timespec='seconds')}", '']
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"traced now {_mb(current)}, peak {_mb(peak)}")
+    import store
+    if store._snapshot is not None:
+        lines += ['', 'Shared snapshot (one copy for all sessions):']
+        sizes = shared_sizes(store._snapshot)
+        for name, size in sorted(sizes.items(), key=lambda kv: -kv[1]):
+            lines.append(f"  {_mb(size)}  {name}")
+        lines.append(f"  {_mb(sum(sizes.values()))}  total")
+    lines += ['', f"Sessions: {len(sessions)}"]
+    if sessions:
+        total = sum(s['bytes'] for s in sessions.values())
+        lines.append(f"  session_state total {_mb(total)}, "
+                     f"average {_mb(total / len(sessions))}")
+        groups = {}
+        for s in sessions.values():
+            for name, (count, size) in s['groups'].items():
+                g = groups.setdefault(name, [0, 0])
+                g[0] += count
+                g[1] += size
+        lines += ['', 'session_state keys across all sessions, biggest first:']
+        for name, (count, size) in sorted(groups.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"  {_mb(size)}  {count:7d} keys  {name}")
+        lines += ['', 'Biggest sessions:']
+        for session_id, s in sorted(sessions.items(), key=lambda kv: -kv[1]['bytes'])[:10]:
+            lines.append(f"  {_mb(s['bytes'])}  {s['keys']:5d} keys  {s['widgets']:5d} widget "
+                         f"keys  {session_id}")
+    if tracemalloc.is_tracing():
+        lines += ['', f"Top {TOP_SITES} allocation sites:"]
+        stats = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')
+        for stat in stats[:TOP_SITES]:
+            frame = stat.traceback[0]
+            lines.append(f"  {_mb(stat.size)}  {stat.count:8d} blocks  "
+                         f"{frame.filename}:{frame.lineno}")
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
@@ -0,0 +1,37 @@
+# Process-wide counters and timings. Cheap enough to call from any save path.
+import threading
+
+from events import EVENT_KINDS
+
+_lock = threading.Lock()
+counters = {}
+timings = {}  # name -> [count, total seconds, max seconds]
+
+
+def incr(name, n=1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+def observe(name, seconds):
+    with _lock:
+        t = timings.setdefault(name, [0, 0.0, 0.0])
+        t[0] += 1
+        t[1] += seconds
+        t[2] = max(t[2], seconds)
+
+
+def snapshot():
+    with _lock:
+        result = dict(counters)
+        for name, (count, total, worst) in timings.items():
+            result[f"{name}.count"] = count
+            result[f"{name}.avg_ms"] = round(total / count * 1000, 3) if count else 0.0
+            result[f"{name}.max_ms"] = round(worst * 1000, 3)
+    return result
+
+
+def track_events(bus):
+    # count every event published on the bus
+    for kind in EVENT_KINDS:
+        bus.subscribe(kind, lambda event: incr(f"events.{event.kind}"))
@@ -0,0 +1,164 @@
+# Migrates legacy data files (bookings2.json, chat_messages_v1.json, ...) to the
+# current record shape, streaming one record at a time so memory stays flat no
+# matter how big the file is.
+#
+#   python migrate.py bookings bookings2.json bookings_migrated.json
+#   python migrate.py messages chat_messages_v1.json chat_messages_migrated.json
+#
+# Records are stamped with the current schema version, get a stable id (derived
+# from their position and normalized content, so a re-run gives the same ids),
+# normalized date/time/status and are validated; ones that can't be fixed go to
+# <out>.rejects.ndjson. Output is written to <out>.migrating and only renamed
+# over <out> at the end, so the app keeps reading the old file until the new one
+# is complete. Progress is checkpointed to <out>.migrate-state; running the same
+# command again after an interruption carries on from there.
+import argparse
+import codecs
+import json
+import os
+import sys
+import time
+
+from records import NORMALIZERS
+from schema import upgrade
+
+CHUNK_SIZE = 1 << 16
+CHECKPOINT_EVERY = 10000  # records
+
+
+def iter_json_array(path, offset=0, chunk_size=CHUNK_SIZE):
+    # Yields (record, byte offset just past the record) from a file holding one JSON
+    # array, without loading it all. `offset` is a value previously yielded.
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        buf = ''
+        i = 0  # parse position in buf; buf is only trimmed when more is read
+        pos = offset
+        started = offset > 0
+        eof = False
+        while True:
+            # skip whitespace, separators and the opening bracket
+            j = i
+            while j < len(buf) and (buf[j].isspace() or buf[j] == ',' or
+                                    (buf[j] == '[' and not started)):
+                started = started or buf[j] == '['
+                j += 1
+            if j > i:
+                pos += len(buf[i:j].encode('utf-8'))
+                i = j
+            if buf.startswith(']', i):
+                return
+            if i < len(buf) and started:
+                try:
+                    record, end = decoder.raw_decode(buf, i)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    pos += len(buf[i:end].encode('utf-8'))
+                    i = end
+                    yield record, pos
+                    continue
+            elif i < len(buf):
+                raise ValueError(f"{path} does not hold a JSON array")
+            if eof:
+                return
+            chunk = f.read(chunk_size)
+            buf = buf[i:]
+            i = 0
+            if chunk:
+                buf += text.decode(chunk)
+            else:
+                buf += text.decode(b'', final=True)
+                eof = True
+
+
+def _load_state(state_path, src):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('input') == os.path.abspath(src) else None
+
+
+def _save_state(state_path, state):
+    tmp = state_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path)
+
+
+def migrate(kind, src, out, resume=True, log=sys.stderr):
+    normalize = NORMALIZERS[kind]
+    work_path = out + '.migrating'
+    state_path = out + '.migrate-state'
+    rejects_path = out + '.rejects.ndjson'
+    state = _load_state(state_path, src) if resume else None
+    if state is None or not os.path.exists(work_path):
+        state = {'input': os.path.abspath(src), 'in_offset': 0, 'out_offset': 0,
+                 'index': 0, 'written': 0, 'rejected': 0, 'rejects_offset': 0}
+    elif log:
+        print(f"resuming at record {state['index']}", file=log)
+
+    started = time.perf_counter()
+    mode = 'r+b' if state['out_offset'] else 'wb'
+    with open(work_path, mode) as out_f, open(rejects_path, 'ab') as rej_f:
+        # throw away anything written after the last checkpoint
+        out_f.truncate(state['out_offset'])
+        out_f.seek(state['out_offset'])
+        rej_f.truncate(state['rejects_offset'])
+        if not state['out_offset']:
+            out_f.write(b'[')
+        since_checkpoint = 0
+        for record, in_offset in iter_json_array(src, state['in_offset']):
+            try:
+                line = json.dumps(upgrade(kind, normalize(record, key=state['index']),
+                                         state['index']))
+            except ValueError as e:
+                rej_f.write(json.dumps({'index': state['index'], 'reason': str(e),
+                                        'record': record}).encode('utf-8') + b'\n')
+                state['rejected'] += 1
+            else:
+                out_f.write(((', ' if state['written'] else '') + line).encode('utf-8'))
+                state['written'] += 1
+            state['index'] += 1
+            state['in_offset'] = in_offset
+            since_checkpoint += 1
+            if since_checkpoint >= CHECKPOINT_EVERY:
+                out_f.flush()
+                rej_f.flush()
+                os.fsync(out_f.fileno())
+                state['out_offset'] = out_f.tell()
+                state['rejects_offset'] = rej_f.tell()
+                _save_state(state_path, state)
+                since_checkpoint = 0
+        out_f.write(b']')
+        out_f.flush()
+        os.fsync(out_f.fileno())
+    os.replace(work_path, out)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    if not state['rejected'] and os.path.exists(rejects_path):
+        os.remove(rejects_path)
+    if log:
+        print(f"{kind}: {state['written']} written, {state['rejected']} rejected "
+              f"in {time.perf_counter() - started:.2f}s -> {out}", file=log)
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate a legacy data file to the current schema.")
+    parser.add_argument('kind', choices=sorted(NORMALIZERS))
+    parser.add_argument('src')
+    parser.add_argument('out')
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore any saved progress and start from the top")
+    args = parser.parse_args(argv)
+    migrate(args.kind, args.src, args.out, resume=not args.restart)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# The booking calendar as one custom component (calendar_component/index.html):
+# the browser draws the month and its status icons from one digit per day, and
+# only a click comes back, instead of a button widget (and its key and delta) for
+# every day of the month.
+#
+#   clicked = month_calendar(2025, 3, store.month_codes(2025, 3), selected=..., key=...)
+import os
+from datetime import date
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+_component = components.declare_component(
+    'month_calendar',
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calendar_component'))
+
+
+def month_calendar(year, month, codes, selected=None, key='month_calendar'):
+    # The date clicked since the last rerun ("YYYY-MM-DD"), else None. A component
+    # keeps returning its last value on every rerun, so each click carries a nonce
+    # and a click is only reported once.
+    value = _component(year=year, month=month, codes=codes, selected=selected,
+                       today=date.today().isoformat(), key=key, default=None)
+    if not value or value.get('nonce') == st.session_state.get(f"_{key}_nonce"):
+        return None
+    st.session_state[f"_{key}_nonce"] = value.get('nonce')
+    return value.get('date')
@@ -0,0 +1,132 @@
+# Normalizing and validating message / booking records. Raises ValueError with a
+# readable reason for anything that can't be fixed up.
+import re
+import uuid
+from datetime import date, datetime
+
+from schedule import DEFAULT_DURATION
+
+STATUSES = ('Pending', 'Confirmed', 'Blocked')
+_STATUS_ALIASES = {
+    'pending': 'Pending', 'requested': 'Pending', '': 'Pending',
+    'confirmed': 'Confirmed', 'confirm': 'Confirmed', 'approved': 'Confirmed',
+    'blocked': 'Blocked', 'block': 'Blocked', 'denied': 'Blocked', 'deny': 'Blocked',
+}
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d.%m.%Y')
+_TIME_FORMATS = ('%H:%M:%S', '%H:%M', '%I:%M %p', '%I:%M%p', '%I %p', '%H:%M:%S.%f')
+_PLAIN_TIME = re.compile(r'(\d{1,2}):(\d{2})(?::(\d{2}))?$')
+
+# ids for legacy records are derived from their content, so a re-run gives the same ids
+ID_NAMESPACE = uuid.UUID('5b0f3c1e-7f2a-4c55-9d6e-53e1e9c0c7a1')
+
+
+def stable_id(kind, key):
+    return str(uuid.uuid5(ID_NAMESPACE, f"{kind}:{key}"))
+
+
+def normalize_date(value):
+    value = str(value).strip()
+    # strptime is slow; try the common shape first
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        pass
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"bad date {value!r}")
+
+
+def normalize_time(value):
+    value = str(value).strip().upper()
+    m = _PLAIN_TIME.match(value)
+    if m:
+        h, mi, sec = int(m.group(1)), int(m.group(2)), int(m.group(3) or 0)
+        if h < 24 and mi < 60 and sec < 60:
+            return f"{h:02d}:{mi:02d}:{sec:02d}"
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%H:%M:%S')
+        except ValueError:
+            pass
+    raise ValueError(f"bad time {value!r}")
+
+
+def normalize_status(value):
+    status = _STATUS_ALIASES.get(str(value or '').strip().lower())
+    if status is None:
+        raise ValueError(f"bad status {value!r}")
+    return status
+
+
+def _text(record, field, required=True):
+    value = record.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f"missing {field}")
+    return value
+
+
+def normalize_booking(record, key=None):
+    # key: something stable for this record (e.g. its position in a legacy file)
+    # used to derive an id when the record has none
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    booking = dict(record)
+    booking['parent'] = _text(record, 'parent')
+    booking['child'] = _text(record, 'child')
+    booking['date'] = normalize_date(_text(record, 'date'))
+    booking['time'] = normalize_time(record.get('time') or '00:00')
+    booking['status'] = normalize_status(record.get('status', 'Pending'))
+    try:
+        booking['duration'] = int(record.get('duration', DEFAULT_DURATION))
+    except (TypeError, ValueError):
+        raise ValueError(f"bad duration {record.get('duration')!r}")
+    if booking['duration'] <= 0:
+        raise ValueError(f"bad duration {booking['duration']!r}")
+    if not record.get('id'):
+        booking['id'] = str(uuid.uuid4()) if key is None else legacy_id('bookings', key, booking)
+    return booking
+
+
+def normalize_message(record, key=None):
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    msg = dict(record)
+    msg['name'] = _text(record, 'name')
+    msg['message'] = _text(record, 'message')
+    timestamp = _text(record, 'timestamp')
+    try:
+        msg['timestamp'] = datetime.fromisoformat(timestamp).isoformat()
+    except ValueError:
+        raise ValueError(f"bad timestamp {timestamp!r}")
+    if not record.get('id'):
+        msg['id'] = str(uuid.uuid4()) if key is None else legacy_id('messages', key, msg)
+    return msg
+
+
+def legacy_id(kind, key, record):
+    # The id for a record that has none, from key and its normalized content. Both
+    # normalize_* and the schema upgrade (schema.py) use it, so a legacy record gets
+    # the same id migrated or read as it is. A field that doesn't normalize is
+    # taken as written: the upgrade still needs an id for it.
+    if kind == 'bookings':
+        content = (f"{_lenient(normalize_date, record.get('date'))}:"
+                   f"{_lenient(normalize_time, record.get('time') or '00:00')}:"
+                   f"{_text(record, 'parent', False)}:{_text(record, 'child', False)}")
+        return stable_id('booking', f"{key}:{content}")
+    timestamp = _lenient(lambda v: datetime.fromisoformat(v.strip()).isoformat(),
+                         record.get('timestamp'))
+    return stable_id('message', f"{key}:{timestamp}:{_text(record, 'name', False)}")
+
+
+def _lenient(normalize, value):
+    try:
+        return normalize('' if value is None else str(value))
+    except ValueError:
+        return '' if value is None else str(value).strip()
+
+
+NORMALIZERS = {'bookings': normalize_booking, 'messages': normalize_message}
@@ -0,0 +1,157 @@
+# Scheduling helpers for play dates: durations and a per-date interval index
+import bisect
+from datetime import date
+
+DEFAULT_DURATION = 60  # minutes, for bookings made before durations existed
+DAY_MINUTES = 24 * 60
+
+# Confirmed and Blocked bookings hold their slot, Pending ones only get flagged
+HOLD_STATUSES = ('Confirmed', 'Blocked')
+PENDING_STATUSES = ('Pending',)
+
+
+def time_to_minutes(t):
+    parts = str(t).split(':')
+    return int(parts[0]) * 60 + int(parts[1])
+
+
+def minutes_to_time(m):
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+
+def booking_interval(b):
+    # (start, end) in minutes from midnight, clipped to the day. None if the time is junk.
+    try:
+        start = time_to_minutes(b.get('time', '00:00'))
+    except (TypeError, ValueError, IndexError):
+        return None
+    try:
+        duration = int(b.get('duration', DEFAULT_DURATION))
+    except (TypeError, ValueError):
+        duration = DEFAULT_DURATION
+    return start, min(start + max(duration, 1), DAY_MINUTES)
+
+
+def format_interval(b):
+    interval = booking_interval(b)
+    if interval is None:
+        return str(b.get('time', ''))
+    return f"{minutes_to_time(interval[0])}–{minutes_to_time(interval[1])}"
+
+
+class IntervalIndex:
+    # date -> intervals sorted by start, with a running max of the end times, so
+    # "does start-end overlap anything on this date" is one bisect instead of a scan.
+
+    def __init__(self, bookings=(), statuses=HOLD_STATUSES):
+        self.statuses = statuses
+        self.days = {}
+        self._shared = set()  # days whose lists still belong to the index we were copied from
+        for b in bookings:
+            self.add(b)
+
+    def copy(self):
+        # copy-on-write: the per-day lists stay shared until this copy changes one
+        other = IntervalIndex(statuses=self.statuses)
+        other.days = dict(self.days)
+        other._shared = set(self.days)
+        return other
+
+    def _own_day(self, date_str):
+        day = self.days.get(date_str)
+        if day is None:
+            day = self.days[date_str] = ([], [], [], [])
+        elif date_str in self._shared:
+            day = self.days[date_str] = tuple(list(column) for column in day)
+            self._shared.discard(date_str)
+        return day
+
+    def add(self, b):
+        if b.get('status', 'Pending') not in self.statuses:
+            return
+        interval = booking_interval(b)
+        if interval is None:
+            return
+        starts, ends, ids, max_ends = self._own_day(b['date'])
+        i = bisect.bisect_right(starts, interval[0])
+        starts.insert(i, interval[0])
+        ends.insert(i, interval[1])
+        ids.insert(i, b.get('id'))
+        max_ends.insert(i, 0)
+        self._fix_max_ends(b['date'], i)
+
+    def remove(self, b):
+        day = self.days.get(b.get('date'))
+        if not day or b.get('id') not in day[2]:
+            return
+        day = self._own_day(b['date'])
+        i = day[2].index(b.get('id'))
+        for column in day:
+            del column[i]
+        if not day[0]:
+            del self.days[b['date']]
+        elif i < len(day[0]):
+            self._fix_max_ends(b['date'], i)
+
+    def _fix_max_ends(self, date_str, i):
+        starts, ends, ids, max_ends = self.days[date_str]
+        running = max_ends[i - 1] if i else 0
+        for j in range(i, len(starts)):
+            running = max(running, ends[j])
+            max_ends[j] = running
+
+    def overlaps(self, date_str, start, end):
+        day = self.days.get(date_str)
+        if not day:
+            return False
+        starts, ends, ids, max_ends = day
+        # everything starting before `end` is a candidate; the latest of their ends decides
+        i = bisect.bisect_left(starts, end)
+        return i > 0 and max_ends[i - 1] > start
+
+    def intervals(self, date_str):
+        day = self.days.get(date_str)
+        if not day:
+            return []
+        return list(zip(day[0], day[1]))
+
+
+# ---- availability search ----
+
+def next_free_dates(occupied, start, end, n):
+    # jump from gap to gap between occupied days instead of testing every candidate date
+    result = []
+    day, last = start.toordinal(), end.toordinal()
+    i = bisect.bisect_left(occupied, day)
+    while day <= last and len(result) < n:
+        if i < len(occupied) and occupied[i] == day:
+            day += 1
+            i += 1
+            continue
+        gap_end = min(occupied[i] - 1 if i < len(occupied) else last, last)
+        take = min(n - len(result), gap_end - day + 1)
+        result.extend(date.fromordinal(d) for d in range(day, day + take))
+        day = gap_end + 1
+    return result
+
+
+def next_free_slots(index, start, end, n, duration, day_start=9 * 60, day_end=18 * 60):
+    # earliest start of each free gap of at least `duration` minutes, as (date, 'HH:MM')
+    result = []
+    for d in range(start.toordinal(), end.toordinal() + 1):
+        day = date.fromordinal(d)
+        cursor = day_start
+        for s, e in index.intervals(day.isoformat()):
+            if cursor >= day_end:
+                break
+            # a gap ends at the next booking or the end of the day, whichever is first
+            if min(s, day_end) - cursor >= duration:
+                result.append((day, minutes_to_time(cursor)))
+                if len(result) >= n:
+                    return result
+            cursor = max(cursor, e)
+        if day_end - cursor >= duration:
+            result.append((day, minutes_to_time(cursor)))
+            if len(result) >= n:
+                return result
+    return result
@@ -0,0 +1,103 @@
+# Record schema versions. Every record carries "v"; older records are brought up
+# to date by the upgrade functions registered here when they are read, and get
+# written back in the new shape the next time their file is saved. Changing the
+# record shape means bumping CURRENT and adding one upgrader, no file rewrite.
+#
+# Upgraders get the record's position in its file too. Ids made up for records
+# from before ids include it, the way migrate.py does, so two identical legacy
+# records (a double click back then) still get different ids. A record with no
+# position (not from a file) gets a random id; it's saved with it right away.
+import uuid
+
+from records import legacy_id
+from schedule import DEFAULT_DURATION
+
+CURRENT = {'messages': 1, 'bookings': 2}
+
+_upgraders = {}  # (kind, from version) -> function
+
+
+def upgrader(kind, from_version):
+    def register(fn):
+        _upgraders[(kind, from_version)] = fn
+        return fn
+    return register
+
+
+def upgrade(kind, record, position=None):
+    v = record.get('v', 0)
+    if v >= CURRENT[kind]:
+        return record
+    record = dict(record)
+    while v < CURRENT[kind]:
+        record = _upgraders[(kind, v)](record, position)
+        v += 1
+        record['v'] = v
+    return record
+
+
+class LazyRecords:
+    # Read-only sequence over raw records that upgrades each one the first time
+    # it's read, so loading a file costs nothing extra however old its records are.
+
+    __slots__ = ('kind', '_items')
+
+    def __init__(self, kind, items):
+        self.kind = kind
+        self._items = list(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self._items)))]
+        if i < 0:
+            i += len(self._items)
+        record = self._items[i]
+        if record.get('v', 0) < CURRENT[self.kind]:
+            # same result whichever reader gets here first, so no lock needed
+            record = self._items[i] = upgrade(self.kind, record, i)
+        return record
+
+    def __iter__(self):
+        for i in range(len(self._items)):
+            yield self[i]
+
+    def __add__(self, other):
+        return LazyRecords(self.kind, self._items + list(other))
+
+
+# ---- upgrades ----
+
+def _new_id(kind, record, position):
+    # same as records.normalize_*(record, key=position)
+    if position is None:
+        return str(uuid.uuid4())
+    return legacy_id(kind, position, record)
+
+
+@upgrader('messages', 0)
+def _message_v1(msg, position):
+    # records from before ids (chat_messages_v1.json)
+    if not msg.get('id'):
+        msg['id'] = _new_id('messages', msg, position)
+    return msg
+
+
+@upgrader('bookings', 0)
+def _booking_v1(b, position):
+    # every booking has an id, a status and a duration
+    if not b.get('id'):
+        b['id'] = _new_id('bookings', b, position)
+    b.setdefault('status', 'Pending')
+    b.setdefault('duration', DEFAULT_DURATION)
+    return b
+
+
+@upgrader('bookings', 1)
+def _booking_v2(b, position):
+    # what the play date is for, and any notes (e.g. asking us to go somewhere)
+    b.setdefault('reason', 'Play date')
+    b.setdefault('notes', '')
+    return b
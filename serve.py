@@ -0,0 +1,30 @@
+# Starts the Streamlit server with the data already loaded and indexed, so the
+# first visitor after a restart doesn't pay for it. Takes the same options as
+# `streamlit run`:
+#
+#   python serve.py --server.port 8501 --server.headless true
+#
+# The app runs in this same process and picks up the warmed store as it is.
+import os
+import sys
+
+import memprofile
+import store
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+def main(argv=None):
+    memprofile.start()  # before loading, so the data's allocations are traced
+    took = store.warm_start()
+    store.start_watching()
+    snap = store.snapshot()
+    print(f"warmed {len(snap.messages)} messages and {len(snap.bookings)} bookings "
+          f"in {took * 1000:.0f} ms", file=sys.stderr)
+    from streamlit.web import cli
+    sys.argv = ['streamlit', 'run', APP] + list(sys.argv[1:] if argv is None else argv)
+    return cli.main()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# Load generator for the app itself: N simulated users, each an AppTest session
+# running app.py, post messages, request bookings and confirm / deny their own
+# requests against one shared data directory. Each worker process plays a
+# Streamlit server worker with several sessions sharing its store; the processes
+# run in parallel. (AppTest isn't thread-safe, so the sessions in one process take
+# turns action by action rather than running in threads.)
+#
+#   python session_loadgen.py --processes 4 --users 3 --actions 25
+#
+# At the end the data files are compared with every write the app acknowledged
+# ("Message sent!", "Play date booked!", "Booking confirmed." ...), which gives
+# the number of lost, duplicated and wrong-status writes. Needs streamlit. Uses a
+# fresh scratch data directory unless --data-dir is given.
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, time as dtime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, 'app.py')
+PIN = 'loadgen'
+
+
+def _widget(elements, label):
+    for w in elements:
+        if w.label == label:
+            return w
+    raise LookupError(f"no widget {label!r}")
+
+
+def _said(at, text):
+    return any(text in str(m.value) for m in at.success)
+
+
+class User:
+    # one simulated person in one browser tab
+    def __init__(self, name, rng):
+        self.name = name
+        self.rng = rng
+        self.latencies = []
+        self.messages = []  # texts the app said were sent
+        self.bookings = []  # child names the app said were booked
+        self.statuses = {}  # child name -> status the app said it set
+        self.failures = 0
+        self.open_tab()
+
+    def open_tab(self):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP, default_timeout=120)
+        self.at.secrets['pin_key'] = PIN
+        self.run()
+
+    def run(self, widget=None):
+        started = time.perf_counter()
+        (widget or self.at).run()
+        self.latencies.append(time.perf_counter() - started)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].value)
+
+    def pick_date(self, date_str):
+        # AppTest can't click inside the calendar component; set what a click sets
+        self.at.session_state['selected_date'] = date_str
+        self.at.session_state['view_bookings_for_date'] = date_str
+        self.run()
+
+    def post_message(self, n):
+        text = f"{self.name} message {n}"
+        _widget(self.at.text_input, "Your Name").set_value(self.name)
+        _widget(self.at.text_area, "Message").set_value(text)
+        self.run(_widget(self.at.button, "Send").click())
+        if _said(self.at, "Message sent!"):
+            self.messages.append(text)
+
+    def book(self, n):
+        today = date.today()
+        day = self.rng.randrange(1, 29)
+        self.pick_date(f"{today.year}-{today.month:02d}-{day:02d}")
+        child = f"{self.name} child {n}"
+        _widget(self.at.text_input, "Parent's Name").set_value(self.name)
+        _widget(self.at.text_input, "Child's Name").set_value(child)
+        _widget(self.at.number_input, "Duration (minutes)").set_value(15)
+        self.at.time_input[0].set_value(dtime(self.rng.randrange(0, 24),
+                                              self.rng.choice((0, 15, 30, 45))))
+        self.run(_widget(self.at.button, "Submit Booking").click())
+        if _said(self.at, "Play date booked!"):
+            self.bookings.append((child, f"{today.year}-{today.month:02d}-{day:02d}"))
+
+    def decide(self):
+        # confirm or deny one of our own pending requests
+        pending = [b for b in self.bookings if b[0] not in self.statuses]
+        if not pending:
+            return
+        child, day = self.rng.choice(pending)
+        self.pick_date(day)
+        action = self.rng.choice(('Confirm', 'Deny'))
+        button = _widget(self.at.button, f"{action} {child}")
+        booking_id = button.key.split('_', 1)[1]
+        self.run(button.click())
+        self.at.text_input(key=f"pin_input_{action.lower()}_{booking_id}").set_value(PIN)
+        self.run(_widget(self.at.button, f"Submit {action} {booking_id}").click())
+        if _said(self.at, "Booking confirmed." if action == 'Confirm' else "Booking denied."):
+            self.statuses[child] = 'Confirmed' if action == 'Confirm' else 'Blocked'
+        # the app drops the PIN box's state once it's used, which AppTest can't
+        # replay on the next run; a browser would just re-render, so open a new tab
+        self.open_tab()
+
+    def act(self, n):
+        what = self.rng.random()
+        try:
+            if what < 0.5:
+                self.post_message(n)
+            elif what < 0.85:
+                self.book(n)
+            else:
+                self.decide()
+        except (LookupError, RuntimeError):
+            self.failures += 1
+
+    def result(self):
+        return {'latencies': self.latencies, 'messages': self.messages,
+                'bookings': [child for child, day in self.bookings],
+                'statuses': self.statuses, 'failures': self.failures}
+
+
+def worker(process, n_users, actions, seed):
+    # runs in a child process; prints one JSON result per user
+    users = [User(f"p{process}u{u}", random.Random(seed * 1000 + process * 100 + u))
+             for u in range(n_users)]
+    for n in range(actions):
+        for user in users:
+            user.act(n)
+    for user in users:
+        print(json.dumps(user.result()))
+
+
+def _percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0.0
+
+
+def check(data_dir, results):
+    # compare what the app acknowledged with what's in the files
+    with open(os.path.join(data_dir, 'chat_messages.json')) as f:
+        messages = json.load(f)
+    with open(os.path.join(data_dir, 'bookings.json')) as f:
+        bookings = json.load(f)
+    sent = [m for r in results for m in r['messages']]
+    booked = [c for r in results for c in r['bookings']]
+    statuses = {c: s for r in results for c, s in r['statuses'].items()}
+    texts = {}
+    for m in messages:
+        texts[m.get('message')] = texts.get(m.get('message'), 0) + 1
+    children = {}
+    for b in bookings:
+        children.setdefault(b.get('child'), []).append(b)
+    return {
+        'messages acknowledged': len(sent),
+        'messages lost': sum(1 for m in sent if texts.get(m, 0) == 0),
+        'messages duplicated': sum(texts.get(m, 0) - 1 for m in sent if texts.get(m, 0) > 1),
+        'bookings acknowledged': len(booked),
+        'bookings lost': sum(1 for c in booked if c not in children),
+        'bookings duplicated': sum(len(children[c]) - 1 for c in booked if c in children),
+        'status changes acknowledged': len(statuses),
+        'status changes lost': sum(1 for c, s in statuses.items()
+                                   if not any(b.get('status') == s for b in children.get(c, []))),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test of app.py.")
+    parser.add_argument('--processes', type=int, default=4, help="server worker processes")
+    parser.add_argument('--users', type=int, default=3, help="sessions per process")
+    parser.add_argument('--actions', type=int, default=25, help="actions per session")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', help="shared data directory (default: a scratch one)")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker is not None:
+        return worker(args.worker, args.users, args.actions, args.seed)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='selene-load-')
+    for name in ('chat_messages.json', 'bookings.json'):
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            with open(path, 'w') as f:
+                json.dump([], f)
+    env = dict(os.environ, SELENE_DATA_DIR=data_dir, SELENE_INDEX_FILE='0',
+               SELENE_LIMIT_CHAT='1000000/1', SELENE_LIMIT_BOOKING='1000000/1')
+    started = time.perf_counter()
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', str(p),
+                               '--users', str(args.users), '--actions', str(args.actions),
+                               '--seed', str(args.seed)],
+                              cwd=HERE, env=env, stdout=subprocess.PIPE, text=True)
+             for p in range(args.processes)]
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        results += [json.loads(line) for line in out.splitlines() if line.startswith('{')]
+    took = time.perf_counter() - started
+    # give the last writes a moment to land before reading the files
+    time.sleep(0.5)
+
+    latencies = sorted(t for r in results for t in r['latencies'])
+    print(f"{len(results)} sessions ({args.processes} processes x {args.users} users), "
+          f"{len(latencies)} reruns in {took:.1f}s = {len(latencies) / took:.1f} reruns/s")
+    print("rerun latency ms: " + ", ".join(
+        f"p{int(p * 100)} {_percentile(latencies, p) * 1000:.0f}" for p in (0.5, 0.95, 0.99)))
+    print(f"failed actions: {sum(r['failures'] for r in results)}")
+    report = check(data_dir, results)
+    for name, value in report.items():
+        print(f"{name}: {value}")
+    if not args.data_dir:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    lost = sum(v for k, v in report.items() if 'lost' in k or 'duplicated' in k)
+    return 1 if lost else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
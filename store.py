@@ -0,0 +1,496 @@
+# Data store: reading and writing the JSON files. Holds the one shared Snapshot of
+# the data for this process; every change goes through the functions below, which
+# write the file, swap in a new Snapshot and publish the change on the event bus.
+#
+# Several server processes can share the data files: reads take a shared lock and
+# every change is a read-modify-write under an exclusive lock (fcntl advisory
+# locks on a <file>.lock next to each data file), which first reloads the file if
+# another process wrote it since we last read it.
+#
+# With SELENE_BINARY_SNAPSHOT=1 the data is opened from binary snapshots next to
+# the JSON files when they're up to date (see binsnap.py): messages are then read
+# through mmap a record at a time and never loaded whole. With SELENE_CHAT_LOG=1
+# the chat is kept as a log instead, one message per line, that new messages are
+# appended to (see chatlog.py).
+import atexit
+import calendar
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single process there
+    fcntl = None
+
+from events import (bus, MESSAGE_ADDED, MESSAGE_DELETED, BOOKING_ADDED,
+                    BOOKING_STATUS_CHANGED)
+from schema import LazyRecords, upgrade
+from views import Snapshot
+from watcher import FileWatcher, file_stat
+import binsnap
+import chatlog
+import daytable
+import index_file
+import metrics
+
+# Data files, in SELENE_DATA_DIR (default: the working directory)
+DATA_DIR = os.environ.get('SELENE_DATA_DIR', '')
+USE_CHAT_LOG = os.environ.get('SELENE_CHAT_LOG') == '1'
+LEGACY_CHAT_FILE = os.path.join(DATA_DIR, 'chat_messages.json')
+CHAT_FILE = os.path.join(DATA_DIR, chatlog.LOG_FILE) if USE_CHAT_LOG else LEGACY_CHAT_FILE
+BOOKINGS_FILE = os.path.join(DATA_DIR, 'bookings.json')
+INDEX_FILE = os.path.join(DATA_DIR, index_file.INDEX_FILE)
+# per-day status codes shared by every process (see daytable.py)
+DAY_TABLE_FILE = os.path.join(DATA_DIR, '.selene_days.bin')
+BINARY_FILES = {'messages': os.path.join(DATA_DIR, '.selene_messages.bin'),
+                'bookings': os.path.join(DATA_DIR, '.selene_bookings.bin')}
+
+watcher = None
+_snapshot = None
+_watcher_lock = threading.Lock()
+# stat of each file right after this process last wrote it, so the watcher can
+# tell our own writes (already published) from somebody else's
+_own_stats = {}
+_write_lock = threading.RLock()
+_day_table = None
+# set once the data is loaded and indexed (warm_start)
+ready = threading.Event()
+_warm_lock = threading.Lock()
+
+# Start from the index file when it's up to date (see index_file.py), and leave an
+# up-to-date one behind on exit
+USE_INDEX_FILE = os.environ.get('SELENE_INDEX_FILE', '1') != '0'
+_index_stamps = {}  # stamps of the index file on disk, when we know it's current
+# Binary snapshots instead; they're rebuilt on start and exit when the JSON files
+# have moved on. An mmap can't go in the index file, so neither they nor the chat
+# log go with it.
+USE_BINARY = os.environ.get('SELENE_BINARY_SNAPSHOT') == '1'
+if USE_BINARY or USE_CHAT_LOG:
+    USE_INDEX_FILE = False
+
+# Repeat submissions (double clicks, replayed reruns, client retries) carry the same
+# idempotency key and are answered with the record the first one made, unwritten.
+IDEMPOTENCY_WINDOW = 120  # seconds
+_recent = {}  # key -> (expiry, record); insertion order is expiry order
+
+
+@contextmanager
+def file_lock(file, exclusive=False):
+    # Advisory lock shared by every process using the data file. Not re-entrant:
+    # don't take it again (or call load_data) while holding it.
+    if fcntl is None:
+        yield
+        return
+    with open(f"{file}.lock", 'a') as f:
+        started = time.perf_counter()
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        metrics.observe(f"store.lock_wait.{'exclusive' if exclusive else 'shared'}",
+                        time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_data(file):
+    with file_lock(file):
+        return _read(file)
+
+
+def _read(file):
+    try:
+        with open(file, 'r') as f:
+            return json.load(f)
+    except:
+        return []
+
+
+def load_messages(current=None):
+    with file_lock(CHAT_FILE):
+        return _read_messages(current)
+
+
+def _read_messages(current=None):
+    # current: the messages we have; a log that has only grown since is extended
+    if not USE_CHAT_LOG:
+        return _read(CHAT_FILE)
+    try:
+        if isinstance(current, chatlog.ChatLog) and current.is_start_of(CHAT_FILE):
+            return current.extended()
+        return chatlog.ChatLog(CHAT_FILE)
+    except:
+        return []
+
+
+def save_data(data, file):
+    # Call with file_lock(file, exclusive=True) held. The data goes to a temp file
+    # that is renamed over the old one, so nobody ever reads half a file.
+    with _write_lock:
+        tmp = f"{file}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            # list() also upgrades any record nobody has read yet, so the file
+            # is written back in the current shape
+            json.dump(list(data), f)
+        os.replace(tmp, file)
+        _wrote(file)
+
+
+def _wrote(file):
+    # after this process changed a data file
+    _own_stats[os.path.abspath(file)] = file_stat(file)
+    if watcher is not None:
+        watcher.check(file)
+
+
+def _start_chat_log():
+    # the first start with SELENE_CHAT_LOG=1 turns chat_messages.json into the log
+    if not USE_CHAT_LOG or os.path.exists(CHAT_FILE):
+        return
+    with file_lock(CHAT_FILE, exclusive=True):
+        if not os.path.exists(CHAT_FILE):
+            chatlog.write(CHAT_FILE, LazyRecords('messages', load_data(LEGACY_CHAT_FILE)))
+
+
+def file_version(file):
+    # changes whenever the file does, from any process and across restarts
+    stat = file_stat(file)
+    return '-'.join(f"{n:x}" for n in stat) if stat else '0'
+
+
+def start_watching():
+    global watcher
+    with _watcher_lock:
+        if watcher is None:
+            watcher = FileWatcher([CHAT_FILE, BOOKINGS_FILE])
+            watcher.subscribe(_on_file_change)
+            watcher.start()
+    return watcher
+
+
+def snapshot():
+    # The current version. It is never changed in place, so readers don't lock;
+    # take it once per rerun to see one consistent version throughout.
+    if _snapshot is None:
+        with _write_lock:
+            if _snapshot is None:
+                _start_chat_log()
+                # stamp before reading: if the file changes in between, the stamp is
+                # older than the data and the next change fixes it, never the reverse
+                stamps = {'messages': file_version(CHAT_FILE),
+                          'bookings': file_version(BOOKINGS_FILE)}
+                new = index_file.load(stamps, INDEX_FILE) if USE_INDEX_FILE else None
+                if new is not None:
+                    _index_stamps.update(stamps)
+                elif USE_BINARY:
+                    new = Snapshot(_open_binary('messages', CHAT_FILE, stamps),
+                                   _open_binary('bookings', BOOKINGS_FILE, stamps))
+                else:
+                    new = Snapshot(load_messages(), load_data(BOOKINGS_FILE))
+                _swap(new, **stamps)
+    return _snapshot
+
+
+def _open_binary(kind, file, stamps):
+    if kind == 'messages' and USE_CHAT_LOG:
+        return load_messages()  # the log reads a page at a time already
+    records = binsnap.open_records(BINARY_FILES[kind], stamps[kind])
+    return records if records is not None else load_data(file)
+
+
+def warm_start():
+    # Load and index everything now instead of on the first visitor's rerun.
+    # Safe to call from anywhere; later calls wait for the first one.
+    # Returns the seconds this call spent warming (0 when it was already done).
+    if ready.is_set():
+        return 0.0
+    with _warm_lock:
+        if ready.is_set():
+            return 0.0
+        started = time.perf_counter()
+        snapshot().warm()
+        sync_day_table()
+        took = time.perf_counter() - started
+        metrics.observe('store.warm_start', took)
+        ready.set()
+        atexit.register(save_index)
+        atexit.register(save_binary)
+    save_index()
+    save_binary()
+    return took
+
+
+def save_index():
+    # write the index file unless it already matches the data files
+    if not USE_INDEX_FILE:
+        return
+    with _write_lock:
+        snap = snapshot().warm()
+        if snap.stamps == _index_stamps:
+            return
+        try:
+            index_file.save(snap, INDEX_FILE)
+        except OSError:
+            return
+        _index_stamps.clear()
+        _index_stamps.update(snap.stamps)
+
+
+def save_binary(force=False):
+    # rebuild the binary snapshots that don't match the data files, from the
+    # snapshot in memory when it's of the same file version
+    if not (USE_BINARY or force):
+        return
+    with _write_lock:
+        snap = snapshot()
+        for kind, file in (('messages', CHAT_FILE), ('bookings', BOOKINGS_FILE)):
+            if kind == 'messages' and USE_CHAT_LOG:
+                continue
+            path = BINARY_FILES[kind]
+            current = binsnap.open_records(path)
+            with file_lock(file):
+                stamp = file_version(file)
+                if current is not None and current.stamp == stamp:
+                    continue
+                records = getattr(snap, kind) if snap.stamps.get(kind) == stamp else \
+                    LazyRecords(kind, _read(file))
+                try:
+                    binsnap.build(kind, records, path, stamp)
+                except OSError:
+                    pass
+
+
+def _swap(new, **stamps):
+    # stamps: file_version() of the data files this version was read from / written to
+    global _snapshot
+    new.version = _snapshot.version + 1 if _snapshot is not None else 1
+    new.stamps = dict(_snapshot.stamps if _snapshot is not None else {}, **stamps)
+    _snapshot = new
+
+
+def _on_file_change(path, version):
+    with _write_lock:
+        if _own_stats.get(path) == file_stat(path):
+            return
+        if _snapshot is not None:
+            if path == os.path.abspath(CHAT_FILE):
+                stamp = file_version(CHAT_FILE)
+                _swap(_snapshot.with_messages(load_messages(_snapshot.messages)),
+                      messages=stamp)
+            elif path == os.path.abspath(BOOKINGS_FILE):
+                stamp = file_version(BOOKINGS_FILE)
+                _swap(_snapshot.with_bookings(load_data(BOOKINGS_FILE)), bookings=stamp)
+    if path == os.path.abspath(BOOKINGS_FILE):
+        # changed from outside (another process's writes update it themselves)
+        sync_day_table()
+
+
+# ---- changes ----
+
+@contextmanager
+def _changing(kind):
+    # Read-modify-write of one data file: hold the exclusive lock throughout and
+    # start from what is in the file now, which another process may have changed.
+    # Yields the up-to-date snapshot to build the change on.
+    file = CHAT_FILE if kind == 'messages' else BOOKINGS_FILE
+    snapshot()  # load first; that takes the shared lock
+    with _write_lock, file_lock(file, exclusive=True):
+        stamp = file_version(file)
+        snap = snapshot()
+        if snap.stamps.get(kind) != stamp:
+            metrics.incr('store.reloads_before_write')
+            if kind == 'messages':
+                snap = snap.with_messages(_read_messages(snap.messages))
+            else:
+                snap = snap.with_bookings(_read(file))
+            _swap(snap, **{kind: stamp})
+        yield snap
+        if kind == 'bookings':
+            _update_day_table(snap, stamp)
+
+
+def _update_day_table(before, stamp):
+    # under the exclusive bookings lock, after a change (or none): bring the shared
+    # table in line with the bookings file, redoing only the dates that changed
+    global _day_table
+    if _day_table is None:
+        _day_table = daytable.open_table(DAY_TABLE_FILE, create=True)
+        if _day_table is None:
+            return
+    after = _snapshot
+    if _day_table.stamp() != stamp:
+        # new table, or someone changed the bookings without updating it
+        _day_table.rebuild(after.by_date, after.stamps['bookings'])
+    elif after is not before:
+        dates = [d for d, bs in after.by_date.items() if before.by_date.get(d) is not bs]
+        _day_table.update(after.by_date, dates, after.stamps['bookings'])
+
+
+def sync_day_table():
+    # make sure the shared table matches the bookings file; cheap when it does
+    with _changing('bookings'):
+        pass
+
+
+def _table():
+    global _day_table
+    if _day_table is None:
+        _day_table = daytable.open_table(DAY_TABLE_FILE)
+    return _day_table
+
+
+def day_code(date_str):
+    # daytable status flags for a date, from the shared table when it matches the
+    # bookings this process has, else from the snapshot itself
+    snap = snapshot()
+    table = _table()
+    code = table.code(date_str, snap.stamps.get('bookings')) if table is not None else None
+    if code is None:
+        code = daytable.day_code(snap.bookings_on(date_str))
+    return code
+
+
+def month_codes(year, month):
+    # daytable status flags for every day of a month, as one digit per day
+    days = calendar.monthrange(year, month)[1]
+    snap = snapshot()
+    table = _table()
+    codes = table.codes(f"{year}-{month:02d}-01", days, snap.stamps.get('bookings')) \
+        if table is not None else None
+    if codes is None:
+        codes = [daytable.day_code(snap.bookings_on(f"{year}-{month:02d}-{d:02d}"))
+                 for d in range(1, days + 1)]
+    return ''.join(map(str, codes))
+
+
+def add_message(msg, key=None):
+    # True when written, False for a repeat of an earlier submission
+    return add_messages([msg], [key])[0] is not None
+
+
+def add_messages(messages, keys=None):
+    # A whole batch in one write. keys: optional idempotency key per message.
+    # Returns, per message, the stored record, or None for a repeat.
+    with _changing('messages') as snap:
+        fresh, results = _dedupe(messages, keys)
+        if not fresh:
+            return results
+        if USE_CHAT_LOG and isinstance(snap.messages, chatlog.ChatLog):
+            new = snap.with_messages(chatlog.append(snap.messages, (
+                upgrade('messages', m) for m in fresh)))
+            _wrote(CHAT_FILE)
+        else:
+            new = snap.with_new_messages(fresh)
+            _save_messages(new)
+        _swap(new, messages=file_version(CHAT_FILE))
+        added = new.messages[len(new.messages) - len(fresh):]
+        _remember(fresh, added, keys, messages, results)
+    for msg in added:
+        bus.publish(MESSAGE_ADDED, msg)
+    return results
+
+
+def _save_messages(new):
+    # the whole chat file from a snapshot that isn't published yet, whichever
+    # format it's in; a log is then read from the file again
+    if USE_CHAT_LOG:
+        with _write_lock:
+            new.messages = chatlog.write(CHAT_FILE, new.messages)
+            _wrote(CHAT_FILE)
+    else:
+        save_data(new.messages, CHAT_FILE)
+
+
+def delete_message(msg_id):
+    with _changing('messages') as snap:
+        new = snap.without_message(msg_id)
+        _save_messages(new)
+        _swap(new, messages=file_version(CHAT_FILE))
+    bus.publish(MESSAGE_DELETED, {'id': msg_id})
+
+
+def add_booking(booking, key=None):
+    # True when written, False for a repeat of an earlier submission
+    return add_bookings([booking], [key])[0] is not None
+
+
+def add_bookings(bookings, keys=None):
+    # same as add_messages
+    with _changing('bookings') as snap:
+        fresh, results = _dedupe(bookings, keys)
+        if not fresh:
+            return results
+        new = snap.with_new_bookings(fresh)
+        save_data(new.bookings, BOOKINGS_FILE)
+        _swap(new, bookings=file_version(BOOKINGS_FILE))
+        added = new.bookings[len(new.bookings) - len(fresh):]
+        _remember(fresh, added, keys, bookings, results)
+    for b in added:
+        bus.publish(BOOKING_ADDED, b)
+    return results
+
+
+def earlier(key):
+    # the record a key already produced inside the window, or None
+    with _write_lock:
+        _expire()
+        entry = _recent.get(key)
+    return entry[1] if entry else None
+
+
+def _expire():
+    now = time.monotonic()
+    while _recent:
+        key = next(iter(_recent))
+        if _recent[key][0] > now:
+            break
+        del _recent[key]
+
+
+def _dedupe(records, keys):
+    # under _write_lock: -> (records to write, results with None for repeats so far)
+    _expire()
+    fresh, results, batch_keys = [], [], set()
+    for i, record in enumerate(records):
+        key = keys[i] if keys else None
+        if key is not None and (key in _recent or key in batch_keys):
+            results.append(None)
+            continue
+        if key is not None:
+            batch_keys.add(key)
+        fresh.append(record)
+        results.append(record)
+    return fresh, results
+
+
+def _remember(fresh, added, keys, records, results):
+    # under _write_lock, after the write: results get the stored (upgraded) records
+    stored = {id(r): a for r, a in zip(fresh, added)}
+    expiry = time.monotonic() + IDEMPOTENCY_WINDOW
+    for i, record in enumerate(records):
+        if results[i] is None:
+            continue
+        results[i] = stored[id(record)]
+        if keys and keys[i] is not None:
+            _recent[keys[i]] = (expiry, results[i])
+
+
+def set_booking_status(booking_id, status):
+    return set_booking_statuses([booking_id], status) > 0
+
+
+def set_booking_statuses(booking_ids, status):
+    # any number of status changes in one write; returns how many changed
+    with _changing('bookings') as snap:
+        new, changed = snap.with_statuses(booking_ids, status)
+        if new is None:
+            return 0
+        save_data(new.bookings, BOOKINGS_FILE)
+        _swap(new, bookings=file_version(BOOKINGS_FILE))
+    for b in changed:
+        bus.publish(BOOKING_STATUS_CHANGED, {'id': b.get('id'), 'date': b.get('date'),
+                                             'old_status': b.get('status', 'Pending'),
+                                             'status': status})
+    return len(changed)
@@ -0,0 +1,95 @@
+# Token-bucket limits on writes, per browser session and per name, so one stuck
+# tab or one runaway poster can't keep the data files busy for everybody. A
+# rejected submit is answered straight away and never reaches the store.
+#
+# Limits are "burst/seconds": up to `burst` writes at once, refilling at
+# burst / seconds per second. Override with e.g. SELENE_LIMIT_CHAT=10/60.
+import os
+import threading
+import time
+
+import metrics
+
+DEFAULT_LIMITS = {
+    'chat': '5/30',      # 5 messages, then one every 6 seconds
+    'booking': '3/60',   # 3 requests, then one every 20 seconds
+}
+MAX_KEYS = 10000  # buckets kept per limiter before full ones are dropped
+
+
+def parse_limit(text):
+    burst, seconds = str(text).split('/')
+    burst, seconds = float(burst), float(seconds)
+    if burst <= 0 or seconds <= 0:
+        raise ValueError(f"bad limit {text!r}")
+    return burst, burst / seconds
+
+
+class TokenBucket:
+    def __init__(self, burst, rate, now):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return self.tokens
+
+    def wait_time(self):
+        # seconds until the next token, after a refill
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Limiter:
+    # one bucket per key (session id or name) for one kind of write
+    def __init__(self, burst, rate):
+        self.burst = burst
+        self.rate = rate
+        self.buckets = {}
+
+    def bucket(self, key, now):
+        b = self.buckets.get(key)
+        if b is None:
+            if len(self.buckets) >= MAX_KEYS:
+                self._prune(now)
+            b = self.buckets[key] = TokenBucket(self.burst, self.rate, now)
+        b.refill(now)
+        return b
+
+    def _prune(self, now):
+        # a full bucket is the same as no bucket
+        for key in [k for k, b in self.buckets.items() if b.refill(now) >= b.burst]:
+            del self.buckets[key]
+
+
+_lock = threading.Lock()
+_limiters = {}  # action -> (per session Limiter, per name Limiter)
+
+
+def _limiters_for(action):
+    pair = _limiters.get(action)
+    if pair is None:
+        burst, rate = parse_limit(os.environ.get(f"SELENE_LIMIT_{action.upper()}",
+                                                 DEFAULT_LIMITS[action]))
+        pair = _limiters[action] = (Limiter(burst, rate), Limiter(burst, rate))
+    return pair
+
+
+def allow(action, session_id, name=None):
+    # -> (True, 0) and one token spent from each bucket, or (False, seconds to wait)
+    # with nothing spent
+    now = time.monotonic()
+    with _lock:
+        per_session, per_name = _limiters_for(action)
+        buckets = [per_session.bucket(session_id, now)]
+        if name:
+            buckets.append(per_name.bucket(name.strip().lower(), now))
+        if all(b.tokens >= 1 for b in buckets):
+            for b in buckets:
+                b.tokens -= 1
+            return True, 0.0
+        wait = max(b.wait_time() for b in buckets)
+    metrics.incr(f"throttle.{action}.rejected")
+    return False, wait
@@ -0,0 +1,201 @@
+# Immutable snapshots of the data plus everything derived from it (bookings per
+# day, time indexes, held days). One snapshot is shared by every session; a change makes
+# a new snapshot that reuses every part it didn't touch.
+import bisect
+from datetime import date, datetime
+
+from schedule import IntervalIndex, HOLD_STATUSES, PENDING_STATUSES
+from binsnap import BinaryRecords
+from chatlog import ChatLog
+from schema import LazyRecords, upgrade
+
+# message sequences read from disk as they're used (binsnap.py, chatlog.py), kept
+# as they are rather than loaded into memory
+_ON_DISK = (BinaryRecords, ChatLog)
+
+# formatted times only depend on the timestamp string, so one cache serves every version
+_human_times = {}
+
+
+def human_time(timestamp):
+    try:
+        dt = datetime.fromisoformat(timestamp)
+        return dt.strftime('%A, %B %d, %Y at %I:%M %p')
+    except:
+        return timestamp
+
+
+def message_times(snap):
+    # the formatted times this snapshot's messages use, for index_file
+    return {m.get('timestamp'): _human_times[m.get('timestamp')] for m in snap.messages
+            if m.get('timestamp') in _human_times}
+
+
+def restore_message_times(times):
+    _human_times.update(times)
+
+
+def _message_records(messages):
+    return messages if isinstance(messages, _ON_DISK) else LazyRecords('messages', messages)
+
+
+def _day_ordinal(date_str):
+    try:
+        return date.fromisoformat(date_str).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+class Snapshot:
+    # Treat everything here as read-only: records are shared between versions, so
+    # changes go through store.py, which builds the next Snapshot.
+
+    def __init__(self, messages=(), bookings=()):
+        self.version = 0
+        self.stamps = {}  # set by store: file version each part was read from
+        self.messages = _message_records(messages)
+        self.messages_version = 0
+        self._build_bookings(bookings)
+        self.bookings_version = 0
+
+    # ---- reading ----
+
+    def message_time(self, msg):
+        timestamp = msg.get('timestamp')
+        if timestamp not in _human_times:
+            _human_times[timestamp] = human_time(timestamp)
+        return _human_times[timestamp]
+
+    def message_index_at(self, timestamp):
+        # position of the first message at or after timestamp (an ISO string);
+        # messages are in the order they were sent
+        if isinstance(self.messages, ChatLog):
+            return self.messages.index_at(timestamp)
+        return bisect.bisect_left(self.messages, timestamp,
+                                  key=lambda m: m.get('timestamp') or '')
+
+    def bookings_on(self, date_str):
+        return self.by_date.get(date_str, ())
+
+    def warm(self):
+        # do up front what the first reader would otherwise pay for: upgrade every
+        # message and format every message time (not for messages read from disk,
+        # which are there so that only the messages shown get read)
+        if isinstance(self.messages, _ON_DISK):
+            return self
+        for msg in self.messages:
+            self.message_time(msg)
+        return self
+
+    # ---- building the next version ----
+
+    def _copy(self):
+        other = Snapshot.__new__(Snapshot)
+        other.__dict__.update(self.__dict__)
+        return other
+
+    def with_messages(self, messages):
+        other = self._copy()
+        other.messages = _message_records(messages)
+        other.messages_version += 1
+        return other
+
+    def with_new_messages(self, messages):
+        other = self._copy()
+        other.messages = self.messages + tuple(upgrade('messages', m) for m in messages)
+        other.messages_version += 1
+        return other
+
+    def without_message(self, msg_id):
+        return self.with_messages(m for m in self.messages if m.get('id') != msg_id)
+
+    def with_bookings(self, bookings):
+        other = self._copy()
+        other._build_bookings(bookings)
+        other.bookings_version += 1
+        return other
+
+    def with_new_bookings(self, bookings):
+        bookings = tuple(upgrade('bookings', b) for b in bookings)
+        other = self._copy_booking_views()
+        other.bookings = self.bookings + bookings
+        for b in bookings:
+            other._index_booking(b, 1)
+        return other
+
+    def with_statuses(self, booking_ids, status):
+        # One new version for a whole batch. Returns (snapshot, changed bookings as
+        # they were before), or (None, []) when nothing would change.
+        wanted = set(booking_ids)
+        bookings = list(self.bookings)
+        changed = []
+        for i, b in enumerate(bookings):
+            if b.get('id') in wanted and b.get('status', 'Pending') != status:
+                bookings[i] = dict(b, status=status)
+                changed.append((b, bookings[i]))
+        if not changed:
+            return None, []
+        other = self._copy_booking_views()
+        other.bookings = tuple(bookings)
+        for old, updated in changed:
+            other._index_booking(old, -1)
+            other._index_booking(updated, 1)
+        return other, [old for old, updated in changed]
+
+    def _copy_booking_views(self):
+        # new top-level containers; per-date values are replaced, never mutated
+        other = self._copy()
+        other.by_date = dict(self.by_date)
+        other.held_index = self.held_index.copy()
+        other.pending_index = self.pending_index.copy()
+        other._held_counts = dict(self._held_counts)
+        other.bookings_version += 1
+        return other
+
+    def _build_bookings(self, bookings):
+        # the index build reads every booking anyway, so upgrade them here
+        self.bookings = tuple(upgrade('bookings', b, i) for i, b in enumerate(bookings))
+        by_date = {}
+        held_counts = {}
+        for b in self.bookings:
+            date_str = b.get('date')
+            status = b.get('status', 'Pending')
+            by_date.setdefault(date_str, []).append(b)
+            if status in HOLD_STATUSES:
+                ordinal = _day_ordinal(date_str)
+                if ordinal is not None:
+                    held_counts[ordinal] = held_counts.get(ordinal, 0) + 1
+        self.by_date = {d: tuple(bs) for d, bs in by_date.items()}
+        self.held_index = IntervalIndex(self.bookings, HOLD_STATUSES)
+        self.pending_index = IntervalIndex(self.bookings, PENDING_STATUSES)
+        self._held_counts = held_counts
+        self.held_days = tuple(sorted(held_counts))
+
+    def _index_booking(self, b, sign):
+        date_str = b.get('date')
+        status = b.get('status', 'Pending')
+        same = self.by_date.get(date_str, ())
+        if sign > 0:
+            self.by_date[date_str] = same + (b,)
+            self.held_index.add(b)
+            self.pending_index.add(b)
+        else:
+            self.by_date[date_str] = tuple(x for x in same if x.get('id') != b.get('id'))
+            self.held_index.remove(b)
+            self.pending_index.remove(b)
+        if status in HOLD_STATUSES:
+            ordinal = _day_ordinal(date_str)
+            if ordinal is None:
+                return
+            before = self._held_counts.get(ordinal, 0)
+            after = before + sign
+            if after > 0:
+                self._held_counts[ordinal] = after
+            else:
+                self._held_counts.pop(ordinal, None)
+            if before == 0 and after > 0:
+                i = bisect.bisect_left(self.held_days, ordinal)
+                self.held_days = self.held_days[:i] + (ordinal,) + self.held_days[i:]
+            elif before > 0 and after <= 0:
+                i = bisect.bisect_left(self.held_days, ordinal)
+                self.held_days = self.held_days[:i] + self.held_days[i + 1:]
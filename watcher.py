@@ -0,0 +1,136 @@
+# Watches the data files and bumps a per-file version number whenever one changes.
+# Uses inotify on Linux and falls back to polling os.stat everywhere else.
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+
+POLL_INTERVAL = 1.0  # seconds, only used by the stat-polling fallback
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+def file_stat(path):
+    try:
+        st = os.stat(path)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+        return None
+
+
+def _inotify_open(dirs):
+    # returns (fd, {wd: dir}) or None when inotify isn't available
+    libc_name = ctypes.util.find_library('c')
+    if not libc_name:
+        return None
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    wds = {}
+    for d in dirs:
+        wd = libc.inotify_add_watch(fd, os.fsencode(d), WATCH_MASK)
+        if wd < 0:
+            os.close(fd)
+            return None
+        wds[wd] = d
+    return fd, wds
+
+
+class FileWatcher:
+    def __init__(self, paths, poll_interval=POLL_INTERVAL):
+        self.paths = [os.path.abspath(p) for p in paths]
+        self.poll_interval = poll_interval
+        self.versions = {p: 0 for p in self.paths}
+        self.mode = None
+        self._stats = {p: file_stat(p) for p in self.paths}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        dirs = sorted({os.path.dirname(p) for p in self.paths})
+        inotify = _inotify_open(dirs)
+        if inotify is not None:
+            self.mode = 'inotify'
+            target, args = self._run_inotify, inotify
+        else:
+            self.mode = 'poll'
+            target, args = self._run_polling, ()
+        self._thread = threading.Thread(target=target, args=args, name='selene-file-watcher',
+                                         daemon=True)
+        self._thread.start()
+        return self
+
+    def version(self, path):
+        return self.versions.get(os.path.abspath(path), 0)
+
+    def subscribe(self, callback):
+        # callback(path, version) runs on the watcher thread, so keep it short
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def check(self, path):
+        # re-stat one file and bump its version if it changed; also called right after
+        # our own writes so this process doesn't wait on the watcher thread
+        path = os.path.abspath(path)
+        if path not in self.versions:
+            return False
+        current = file_stat(path)
+        with self._lock:
+            if current == self._stats[path]:
+                return False
+            self._stats[path] = current
+            self.versions[path] += 1
+            version = self.versions[path]
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(path, version)
+            except Exception:
+                pass
+        return True
+
+    def _run_polling(self):
+        while True:
+            for path in self.paths:
+                self.check(path)
+            time.sleep(self.poll_interval)
+
+    def _run_inotify(self, fd, wds):
+        while True:
+            try:
+                buf = os.read(fd, 4096)
+            except OSError:
+                # inotify went away under us, keep going the slow way
+                self.mode = 'poll'
+                return self._run_polling()
+            offset = 0
+            changed = set()
+            while offset + _EVENT_HEADER.size <= len(buf):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if wd in wds and name:
+                    changed.add(os.path.join(wds[wd], os.fsdecode(name)))
+            for path in changed:
+                self.check(path)
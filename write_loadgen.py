@@ -0,0 +1,95 @@
+# Load generator for write_server.py: many concurrent keep-alive clients posting
+# chat messages and/or booking requests, then a throughput / latency summary.
+#
+#   python write_loadgen.py --clients 50 --requests 5000 --kind mixed
+#
+# Point it at a scratch copy of the data files, it really writes.
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from write_server import DEFAULT_PORT
+
+
+def make_message(n):
+    return '/messages', {'name': f"loadgen-{n % 20}", 'message': f"hello #{n}"}
+
+
+def make_booking(n):
+    day = date.today() + timedelta(days=365 + random.randrange(365))
+    return '/bookings', {'date': day.isoformat(), 'time': f"{random.randrange(9, 18):02d}:00",
+                         'parent': f"Parent {n % 50}", 'child': f"Child {n % 50}",
+                         'reason': 'Load test'}
+
+
+MAKERS = {'messages': (make_message,), 'bookings': (make_booking,),
+          'mixed': (make_message, make_booking)}
+
+
+async def client(host, port, jobs, makers, latencies, codes):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            try:
+                n = next(jobs)
+            except StopIteration:
+                break
+            path, payload = makers[n % len(makers)](n)
+            body = json.dumps(payload).encode('utf-8')
+            started = time.perf_counter()
+            writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+            status = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            code = int(status.split()[1])
+            codes[code] = codes.get(code, 0) + 1
+    finally:
+        writer.close()
+
+
+def _percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0.0
+
+
+async def run(host, port, clients, requests, kind):
+    jobs = iter(range(requests))
+    latencies, codes = [], {}
+    started = time.perf_counter()
+    await asyncio.gather(*(client(host, port, jobs, MAKERS[kind], latencies, codes)
+                           for _ in range(clients)))
+    took = time.perf_counter() - started
+    latencies.sort()
+    print(f"{len(latencies)} requests from {clients} clients in {took:.2f}s "
+          f"= {len(latencies) / took:.0f}/s")
+    print("latency ms: " + ", ".join(f"p{int(p * 100)} {_percentile(latencies, p) * 1000:.1f}"
+                                     for p in (0.5, 0.95, 0.99)) +
+          f", max {latencies[-1] * 1000 if latencies else 0:.1f}")
+    print("status: " + ", ".join(f"{code} x{count}" for code, count in sorted(codes.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the write API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--kind', choices=sorted(MAKERS), default='mixed')
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.host, args.port, args.clients, args.requests, args.kind))
+
+
+if __name__ == '__main__':
+    main()
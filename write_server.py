@@ -0,0 +1,258 @@
+# Write API for other local services (the school newsletter bot, the kiosk sign-up
+# screen, ...) to post booking requests and chat messages. Every request is
+# validated as it comes in, then queued; a single batcher commits whatever has
+# queued up every few milliseconds in one write per data file, and each caller
+# gets its answer once its batch is on disk.
+#
+#   python write_server.py --port 8504
+#
+# or run it inside the Streamlit server process by setting SELENE_WRITE_PORT.
+#
+#   POST /messages   {"name": ..., "message": ...}
+#   POST /bookings   {"date": ..., "time": ..., "parent": ..., "child": ...,
+#                     "duration": 60, "reason": ..., "notes": ...}
+#
+# Bookings always come in as Pending; confirming stays behind the PIN in the app.
+# Ids and schema versions are the server's: any "id" or "v" sent along is dropped.
+# Send an Idempotency-Key header to make retries safe: a repeat inside the store's
+# window is answered 200 with the record the first request made, and not written.
+import argparse
+import asyncio
+import json
+import threading
+from datetime import datetime
+
+from records import normalize_booking, normalize_message
+from schedule import booking_interval
+import metrics
+import store
+
+DEFAULT_PORT = 8504
+BATCH_WINDOW = 0.005  # seconds to wait for more requests before committing
+MAX_BATCH = 1000
+MAX_BODY = 64 * 1024
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+
+def _server_owned(record):
+    # a new record gets a fresh uuid4 id and the current shape, whatever was sent
+    if isinstance(record, dict):
+        record = {k: v for k, v in record.items() if k not in ('id', 'v')}
+    return record
+
+
+def validate_message(record):
+    record = _server_owned(record)
+    if isinstance(record, dict) and not record.get('timestamp'):
+        record = dict(record, timestamp=datetime.now().isoformat())
+    return normalize_message(record)
+
+
+def validate_booking(record):
+    b = normalize_booking(_server_owned(record))
+    b['status'] = 'Pending'
+    interval = booking_interval(b)
+    if interval and store.snapshot().held_index.overlaps(b['date'], *interval):
+        raise LookupError("that time is already taken")
+    return b
+
+
+VALIDATORS = {'/messages': ('messages', validate_message),
+              '/bookings': ('bookings', validate_booking)}
+
+
+def _commit(batch):
+    # runs in a worker thread; one write per data file for the whole batch.
+    # -> per request, the stored record, None for a repeat, or the exception that
+    # kept it from being saved
+    results = {}
+    for kind, add in (('messages', store.add_messages), ('bookings', store.add_bookings)):
+        items = [item for item in batch if item[0] == kind]
+        if not items:
+            continue
+        try:
+            stored = add([record for k, record, key, future in items],
+                         [key for k, record, key, future in items])
+        except Exception:
+            # nothing of this write was saved; save them one at a time so only
+            # the request that breaks it fails
+            metrics.incr('write_api.split_batches')
+            stored = []
+            for k, record, key, future in items:
+                try:
+                    stored.append(add([record], [key])[0])
+                except Exception as e:
+                    stored.append(e)
+        results.update(zip((id(item) for item in items), stored))
+    return [results[id(item)] for item in batch]
+
+
+class Batcher:
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+
+    async def submit(self, kind, record, key=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, record, key, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            started = loop.time()
+            try:
+                # requests keep queuing while this write is running, so the next
+                # batch grows with the load
+                results = await loop.run_in_executor(None, _commit, batch)
+            except Exception as e:
+                for kind, record, key, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            metrics.observe('write_api.commit', loop.time() - started)
+            metrics.incr('write_api.batches')
+            metrics.incr('write_api.records', len(batch))
+            for (kind, record, key, future), stored in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(stored, Exception):
+                    future.set_exception(stored)
+                else:
+                    future.set_result(stored)
+
+
+async def _read_request(reader):
+    # -> (method, path, headers, body), or None when the client is done
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, path, version = line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY:
+        return method, path, headers, None
+    body = await reader.readexactly(length) if length else b''
+    return method, path.split('?')[0], headers, body
+
+
+def _response(code, payload, keep_alive=True):
+    body = json.dumps(payload).encode('utf-8')
+    head = (f"HTTP/1.1 {code} {REASONS.get(code, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+class WriteServer:
+    def __init__(self, window=BATCH_WINDOW):
+        self.batcher = Batcher(window)
+
+    async def handle(self, method, path, body, key=None):
+        # -> (status code, JSON payload)
+        metrics.incr('write_api.requests')
+        route = VALIDATORS.get(path)
+        if route is None:
+            return 404, {'error': 'not found'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        if body is None:
+            return 413, {'error': 'request too large'}
+        kind, validate = route
+        if key:
+            key = f"{kind}:{key}"
+            earlier = store.earlier(key)
+            if earlier is not None:
+                metrics.incr('write_api.repeats')
+                return 200, earlier
+        try:
+            record = validate(json.loads(body or b'null'))
+        except LookupError as e:
+            metrics.incr('write_api.rejected')
+            return 409, {'error': str(e)}
+        except ValueError as e:
+            metrics.incr('write_api.rejected')
+            return 400, {'error': str(e)}
+        try:
+            stored = await self.batcher.submit(kind, record, key)
+        except Exception as e:
+            return 500, {'error': f"could not save: {e}"}
+        if stored is None:
+            # a repeat that arrived in the same batch as the original
+            metrics.incr('write_api.repeats')
+            return 200, store.earlier(key)
+        return 201, stored
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                code, payload = await self.handle(method, path, body,
+                                                  headers.get('idempotency-key'))
+                writer.write(_response(code, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port=DEFAULT_PORT, host='127.0.0.1', ready=None):
+        store.start_watching()
+        server = await asyncio.start_server(self.serve_client, host, port)
+        batcher = asyncio.ensure_future(self.batcher.run())
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def start_in_background(port=DEFAULT_PORT, host='127.0.0.1'):
+    # for running inside the Streamlit server process
+    ready = threading.Event()
+    thread = threading.Thread(target=lambda: asyncio.run(WriteServer().serve(port, host, ready)),
+                              name='selene-write-api', daemon=True)
+    thread.start()
+    ready.wait(5)
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Club Selene write API.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--window', type=float, default=BATCH_WINDOW * 1000,
+                        help="batch window in milliseconds (default: %(default)s)")
+    args = parser.parse_args(argv)
+    print(f"accepting writes on http://{args.host}:{args.port}/")
+    try:
+        asyncio.run(WriteServer(args.window / 1000).serve(args.port, args.host))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()